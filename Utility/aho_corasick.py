@@ -0,0 +1,143 @@
+def fold_case(text):
+    """Lower-case `text` without changing its length, so offsets stay valid."""
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return "".join(char.lower()[0] for char in text)
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton over a set of literal strings.
+
+    Every key maps to a value. After build(), all occurrences of all keys are
+    found in one pass over the text, however many keys there are.
+    """
+
+    def __init__(self, items=(), ignore_case=False):
+        self.ignore_case = ignore_case
+        self._values = {}
+        for key, value in (items.items() if isinstance(items, dict) else items):
+            self.add(key, value)
+        self._built = False
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return self._normalize(key) in self._values
+
+    def _normalize(self, key):
+        return fold_case(key) if self.ignore_case else key
+
+    def add(self, key, value):
+        if not key:
+            return
+        self._values[self._normalize(key)] = value
+        self._built = False
+
+    def build(self):
+        # Node 0 is the root. For every node keep its transitions, failure
+        # link, depth, the (length, value) of the key ending there and a link
+        # to the next node on the failure chain that also ends a key.
+        goto = [{}]
+        depth = [0]
+        output = [None]
+        for key, value in self._values.items():
+            node = 0
+            for char in key:
+                next_node = goto[node].get(char)
+                if next_node is None:
+                    next_node = len(goto)
+                    goto[node][char] = next_node
+                    goto.append({})
+                    depth.append(depth[node] + 1)
+                    output.append(None)
+                node = next_node
+            output[node] = (len(key), value)
+
+        fail = [0] * len(goto)
+        output_link = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for char, child in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(char, 0)
+                fail[child] = target if target != child else 0
+                output_link[child] = fail[child] if output[fail[child]] else output_link[fail[child]]
+                queue.append(child)
+
+        self._goto = goto
+        self._fail = fail
+        self._depth = depth
+        self._output = output
+        self._output_link = output_link
+        self._max_length = max(depth)
+        self._built = True
+
+    def _ensure_built(self):
+        if not self._built:
+            self.build()
+
+    @property
+    def max_length(self):
+        """Length of the longest key."""
+        self._ensure_built()
+        return self._max_length
+
+    def pending_length(self, text):
+        """Length of the longest suffix of `text` that is the start of some key.
+
+        Text before that suffix cannot become part of a match however the
+        text continues.
+        """
+        self._ensure_built()
+        goto, fail = self._goto, self._fail
+        if self.ignore_case:
+            text = fold_case(text)
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+        return self._depth[state]
+
+    def iter_matches(self, text):
+        """Yield (start, end, value) for every occurrence of every key, by end offset."""
+        self._ensure_built()
+        goto, fail, output, output_link = self._goto, self._fail, self._output, self._output_link
+        if self.ignore_case:
+            text = fold_case(text)
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            node = state if output[state] else output_link[state]
+            while node:
+                length, value = output[node]
+                yield index + 1 - length, index + 1, value
+                node = output_link[node]
+
+    def find_longest(self, text, accept=None):
+        """Return non-overlapping (start, end, value) matches, leftmost-longest first.
+
+        `accept(start, end, value)` can reject a candidate match, e.g. one that
+        is not on a word boundary; the next longest match at that start is used.
+        """
+        candidates = {}
+        for start, end, value in self.iter_matches(text):
+            candidates.setdefault(start, []).append((end, value))
+
+        matches = []
+        last_end = 0
+        for start in sorted(candidates):
+            if start < last_end:
+                continue
+            for end, value in sorted(candidates[start], key=lambda candidate: -candidate[0]):
+                if accept is None or accept(start, end, value):
+                    matches.append((start, end, value))
+                    last_end = end
+                    break
+        return matches
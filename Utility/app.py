@@ -1,7 +1,9 @@
-import json
+import os
 from presidio_analyzer import AnalyzerEngine
 from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.entities import RecognizerResult, OperatorConfig
+from presidio_anonymizer.entities import RecognizerResult
+from Utility.presets import DEFAULT_ENTITIES, DEFAULT_OPERATORS
+from Utility.jsonl_writer import save_output
 
 # Initialize the Presidio analyzer and anonymizer
 analyzer = AnalyzerEngine()
@@ -15,23 +17,7 @@ text = ("My name is John Doe, I am from Nomura, my phone number is 123-456-7890,
 # Analyze the text to identify PII entities
 results = analyzer.analyze(
     text=text, 
-    entities=[
-        "PERSON", 
-        "PHONE_NUMBER", 
-        "EMAIL_ADDRESS", 
-        "ORGANIZATION", 
-        "LOCATION", 
-        "CREDIT_CARD", 
-        "DATE_TIME", 
-        "NRP", 
-        "IP_ADDRESS", 
-        "IBAN_CODE", 
-        "US_DRIVER_LICENSE", 
-        "URL", 
-        "AWS_ACCESS_KEY", 
-        "IPV4", 
-        "IPV6"
-    ], 
+    entities=DEFAULT_ENTITIES,
     language="en"
 )
 
@@ -46,80 +32,7 @@ anonymizer_results = [
 ]
 
 # Configure the anonymizer to use a reversible anonymization method
-anonymizer_config = {
-    "default": OperatorConfig(
-        operator_name="hash",
-        params={"salt": "mysalt"}  # Use a consistent salt for reversible anonymization
-    ),
-    "PERSON": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{PERSON}"}
-    ),
-    "PHONE_NUMBER": OperatorConfig(
-        operator_name="mask",
-        params={
-            "masking_char": "*",
-            "chars_to_mask": 12,
-            "from_end": True
-        }
-    ),
-    "EMAIL_ADDRESS": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{EMAIL}"}
-    ),
-    "ORGANIZATION": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{ORGANIZATION}"}
-    ),
-    "LOCATION": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{LOCATION}"}
-    ),
-    "CREDIT_CARD": OperatorConfig(
-        operator_name="mask",
-        params={
-            "masking_char": "*",
-            "chars_to_mask": 16,
-            "from_end": True
-        }
-    ),
-    "DATE_TIME": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{DATE}"}
-    ),
-    "NRP": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{NRP}"}
-    ),
-    "IP_ADDRESS": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{IP}"}
-    ),
-    "IBAN_CODE": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{IBAN}"}
-    ),
-    "US_DRIVER_LICENSE": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{DRIVER_LICENSE}"}
-    ),
-    "URL": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{URL}"}
-    ),
-    "AWS_ACCESS_KEY": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{AWS_KEY}"}
-    ),
-    "IPV4": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{IPV4}"}
-    ),
-    "IPV6": OperatorConfig(
-        operator_name="replace",
-        params={"new_value": "{IPV6}"}
-    )
-}
+anonymizer_config = DEFAULT_OPERATORS
 
 # Perform the anonymization
 anonymized_text = anonymizer.anonymize(text=text, analyzer_results=anonymizer_results, operators=anonymizer_config)
@@ -139,9 +52,9 @@ output = {
     ]
 }
 
-# Save the output to a JSON file
-with open("anonymized_data.json", "w") as json_file:
-    json.dump(output, json_file, indent=4)
+# Save the output to a JSON file; with ANONYMIZED_OUTPUT set to a
+# .jsonl(.gz/.zst) path, append it as one compact record instead
+save_output(output, os.getenv("ANONYMIZED_OUTPUT", "anonymized_data.json"))
 
 # Print the results
 print("Original Text:", text)
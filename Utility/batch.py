@@ -0,0 +1,73 @@
+import argparse
+import itertools
+import sys
+
+from Utility.jsonl_writer import JsonlWriter
+from Utility.nlp_engine import build_analyzer, get_nlp_engine, needs_ner
+from Utility.profiling import RecognizerProfiler
+
+
+def analyze_batch(analyzer, texts, language="en", entities=None, batch_size=32, n_process=1, **analyze_kwargs):
+    """Analyze an iterable of texts, yielding one result list per text in input order.
+
+    NER runs through spaCy's nlp.pipe in batches of `batch_size` (spread over
+    `n_process` processes); the pattern recognizers then run per document on
+    the precomputed NlpArtifacts. Extra keyword arguments go to analyzer.analyze.
+    """
+    nlp_engine = analyzer.nlp_engine
+    if hasattr(nlp_engine, "process_stream"):
+        processed = nlp_engine.process_stream(texts, language, batch_size=batch_size, n_process=n_process)
+    else:
+        processed = nlp_engine.process_batch(texts, language)
+
+    for text, nlp_artifacts in processed:
+        yield analyzer.analyze(
+            text=text,
+            language=language,
+            entities=entities,
+            nlp_artifacts=nlp_artifacts,
+            **analyze_kwargs
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a file of texts (one per line) in batches.")
+    parser.add_argument("input", help="text file with one document per line")
+    parser.add_argument("output", help="where to write one JSON line of results per document (.gz/.zst to compress)")
+    parser.add_argument("--model", default="en_core_web_lg")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--entities", nargs="*", default=None)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--n-process", type=int, default=1)
+    parser.add_argument("--ner-only", action="store_true", help="load only the NER components of the model")
+    parser.add_argument("--profile", action="store_true", help="print per-recognizer timings to stderr")
+    parser.add_argument("--resume", action="store_true", help="skip the documents already in the output and append")
+    args = parser.parse_args()
+
+    # Only load the model when a requested entity comes from it
+    nlp_engine = get_nlp_engine(args.model, args.language, ner_only=args.ner_only) if needs_ner(args.entities) else None
+    analyzer = build_analyzer(nlp_engine, language=args.language, entities=args.entities)
+    profiler = None
+    if args.profile:
+        profiler = RecognizerProfiler()
+        profiler.instrument(analyzer)
+
+    with open(args.input) as input_file, JsonlWriter(args.output, resume=args.resume) as writer:
+        texts = itertools.islice((line.rstrip("\n") for line in input_file), writer.skip, None)
+        batches = analyze_batch(
+            analyzer,
+            texts,
+            language=args.language,
+            entities=args.entities,
+            batch_size=args.batch_size,
+            n_process=args.n_process,
+        )
+        for results in batches:
+            writer.write([result.to_dict() for result in results])
+
+    if profiler is not None:
+        print(profiler.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import regex as re
+from presidio_analyzer import EntityRecognizer, RecognizerResult
+
+from Utility.aho_corasick import AhoCorasick, fold_case
+
+# Characters that make a regex alternative more than a plain literal
+_REGEX_METACHARACTERS = set(".^$*+?{}[]|()\\")
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
+
+
+def _is_standalone(text, start, end):
+    """True if text[start:end] is not glued to word characters on either side."""
+    return (start == 0 or not _is_word_char(text[start - 1])) and (
+        end == len(text) or not _is_word_char(text[end])
+    )
+
+
+def _split_alternatives(regex):
+    alternatives = []
+    depth = 0
+    current = []
+    escaped = False
+    for char in regex:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            current.append(char)
+            escaped = True
+        elif char == "(":
+            depth += 1
+            current.append(char)
+        elif char == ")":
+            depth -= 1
+            current.append(char)
+        elif char == "|" and depth == 0:
+            alternatives.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    alternatives.append("".join(current))
+    return alternatives
+
+
+def _unescape_literal(alternative):
+    literal = []
+    escaped = False
+    for char in alternative:
+        if escaped:
+            # \d, \w, \b ... are classes, not escaped literals
+            if char.isalnum():
+                return None
+            literal.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in _REGEX_METACHARACTERS:
+            return None
+        else:
+            literal.append(char)
+    return "".join(literal) if literal and not escaped else None
+
+
+def literal_terms(regex):
+    """Return (terms, standalone) if `regex` only matches a set of literal strings.
+
+    Understands the shapes used in this repository: `nomura`,
+    `\\b(Nomura)\\b` and `\\b(Confidentiality Agreement|NDA)\\b`. `standalone`
+    is True when the pattern is wrapped in word boundaries. Returns None for
+    anything that needs a real regex engine.
+    """
+    body = regex
+    standalone = body.startswith(r"\b") and body.endswith(r"\b") and len(body) > 4
+    if standalone:
+        body = body[2:-2]
+    elif r"\b" in body:
+        return None
+    prefix = "(?:" if body.startswith("(?:") else "("
+    if body.startswith(prefix) and body.endswith(")"):
+        inner = body[len(prefix):-1]
+        # Only strip the group if it encloses the whole pattern
+        if "(" not in inner.replace("\\(", "") and ")" not in inner.replace("\\)", ""):
+            body = inner
+
+    terms = []
+    for alternative in _split_alternatives(body):
+        term = _unescape_literal(alternative)
+        if term is None:
+            return None
+        # \b only behaves like a standalone check around word characters
+        if standalone and not (_is_word_char(term[0]) and _is_word_char(term[-1])):
+            return None
+        terms.append(term)
+    return terms, standalone
+
+
+class CombinedPatternRecognizer(EntityRecognizer):
+    """Find all custom regex patterns and deny-list terms in a single scan.
+
+    Regex patterns are compiled into one alternation with a named group per
+    pattern; literal terms (deny-lists, and patterns that are only a list of
+    words) go through an Aho-Corasick automaton, so the cost of a scan does
+    not grow with the number of terms.
+
+    Because one alternation is scanned left to right, a match that overlaps
+    an earlier match of another regex pattern is not reported; patterns with
+    backreferences are scanned on their own.
+
+    :param patterns: list of (entity_type, Pattern)
+    :param deny_lists: dict of entity_type -> list of terms
+    :param deny_list_score: score given to deny-list matches
+    """
+
+    def __init__(
+        self,
+        patterns=(),
+        deny_lists=None,
+        deny_list_score=1.0,
+        name=None,
+        supported_language="en",
+        global_regex_flags=re.DOTALL | re.MULTILINE | re.IGNORECASE,
+    ):
+        self.patterns = list(patterns)
+        self.deny_lists = dict(deny_lists or {})
+        self.deny_list_score = deny_list_score
+        self.global_regex_flags = global_regex_flags
+
+        supported_entities = []
+        for entity_type in [entity for entity, _ in self.patterns] + list(self.deny_lists):
+            if entity_type not in supported_entities:
+                supported_entities.append(entity_type)
+
+        super().__init__(
+            supported_entities=supported_entities,
+            name=name,
+            supported_language=supported_language,
+        )
+
+    def load(self):
+        ignore_case = bool(self.global_regex_flags & re.IGNORECASE)
+        normalize = fold_case if ignore_case else str
+        literals = {}
+        regex_patterns = []
+        for entity_type, pattern in self.patterns:
+            routed = literal_terms(pattern.regex)
+            if routed is None:
+                regex_patterns.append((entity_type, pattern))
+                continue
+            terms, standalone = routed
+            for term in terms:
+                literals.setdefault(normalize(term), []).append((entity_type, pattern.score, pattern.name, standalone))
+        for entity_type, terms in self.deny_lists.items():
+            for term in terms:
+                literals.setdefault(normalize(term), []).append((entity_type, self.deny_list_score, "deny_list", True))
+        self._literals = AhoCorasick(literals, ignore_case=ignore_case)
+        self._literals.build()
+
+        combined = []
+        self._groups = {}
+        self._separate = []
+        for index, (entity_type, pattern) in enumerate(regex_patterns):
+            if re.search(r"\\[1-9]|\(\?P=", pattern.regex):
+                self._separate.append(
+                    (entity_type, pattern, re.compile(pattern.regex, flags=self.global_regex_flags))
+                )
+                continue
+            group = f"_p{index}"
+            self._groups[group] = (entity_type, pattern)
+            combined.append(f"(?P<{group}>{pattern.regex})")
+        self._combined = re.compile("|".join(combined), flags=self.global_regex_flags) if combined else None
+
+    def analyze(self, text, entities, nlp_artifacts=None):
+        wanted = set(entities) if entities else set(self.supported_entities)
+        results = []
+
+        if self._combined is not None:
+            for match in self._combined.finditer(text):
+                group = match.lastgroup
+                if group not in self._groups:
+                    group = next(name for name in self._groups if match.group(name) is not None)
+                entity_type, pattern = self._groups[group]
+                if entity_type in wanted and match.end() > match.start():
+                    results.append(self._result(entity_type, match.start(), match.end(), pattern.score, pattern.name))
+
+        for entity_type, pattern, compiled in self._separate:
+            if entity_type not in wanted:
+                continue
+            for match in compiled.finditer(text):
+                if match.end() > match.start():
+                    results.append(self._result(entity_type, match.start(), match.end(), pattern.score, pattern.name))
+
+        if len(self._literals):
+            def applies(start, end, entry):
+                entity_type, _, _, standalone = entry
+                return entity_type in wanted and (not standalone or _is_standalone(text, start, end))
+
+            def accept(start, end, entries):
+                return any(applies(start, end, entry) for entry in entries)
+
+            for start, end, entries in self._literals.find_longest(text, accept=accept):
+                for entry in entries:
+                    if applies(start, end, entry):
+                        entity_type, score, pattern_name, _ = entry
+                        results.append(self._result(entity_type, start, end, score, pattern_name))
+
+        return results
+
+    def _result(self, entity_type, start, end, score, pattern_name):
+        return RecognizerResult(
+            entity_type=entity_type,
+            start=start,
+            end=end,
+            score=score,
+            recognition_metadata={
+                RecognizerResult.RECOGNIZER_NAME_KEY: self.name,
+                RecognizerResult.RECOGNIZER_IDENTIFIER_KEY: self.id,
+                "pattern_name": pattern_name,
+            },
+        )
@@ -0,0 +1,169 @@
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+# Error codes AWS uses when a caller goes over its request rate
+_THROTTLING_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+_THROTTLING_MESSAGES = ("throttl", "too many requests", "rate exceeded")
+
+
+class StubThrottlingError(Exception):
+    """Raised by StubEmbeddings to imitate a throttled backend."""
+
+
+def is_throttling_error(error):
+    """True if `error` means "slow down" rather than a real failure."""
+    if isinstance(error, StubThrottlingError):
+        return True
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and response.get("Error", {}).get("Code") in _THROTTLING_CODES:
+        return True
+    # BedrockEmbeddings re-raises backend errors as ValueError with the message
+    message = str(error).lower()
+    return any(fragment in message for fragment in _THROTTLING_MESSAGES)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that grows additively on success and halves on throttling."""
+
+    def __init__(self, initial=4, minimum=1, maximum=16, increase_after=10):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_after = increase_after
+        self._active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.increase_after and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def throttled(self):
+        with self._condition:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._successes = 0
+
+
+class ConcurrentEmbeddings(Embeddings):
+    """Send embedding requests to a backend concurrently, in input order.
+
+    Texts are grouped into batches of `batch_size` (1 for backends such as
+    Titan that embed one text per call) and sent through a thread pool. The
+    number of requests in flight adapts to the backend: it grows while
+    requests succeed and halves whenever one is throttled, and throttled
+    requests are retried with exponential backoff.
+    """
+
+    def __init__(self, embeddings, max_concurrency=16, initial_concurrency=4, batch_size=1,
+                 max_retries=8, backoff=0.5, increase_after=10):
+        self.embeddings = embeddings
+        self.model_id = getattr(embeddings, "model_id", None)
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limiter = AdaptiveLimiter(
+            initial=initial_concurrency, maximum=max_concurrency, increase_after=increase_after
+        )
+        self.max_concurrency = max_concurrency
+        self.calls = 0
+        self.throttled = 0
+        self._stats_lock = threading.Lock()
+
+    def _call(self, embed, argument):
+        # One backend request under the limiter, retried while it is throttled
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.limiter:
+                    result = embed(argument)
+            except Exception as error:
+                if not is_throttling_error(error) or attempt == self.max_retries:
+                    raise
+                with self._stats_lock:
+                    self.throttled += 1
+                self.limiter.throttled()
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+            with self._stats_lock:
+                self.calls += 1
+            self.limiter.success()
+            return result
+
+    def _embed_batch(self, batch):
+        return self._call(self.embeddings.embed_documents, batch)
+
+    def embed_documents(self, texts):
+        batches = [texts[offset:offset + self.batch_size] for offset in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            return self._embed_batch(batches[0]) if batches else []
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+            # map() returns results in submission order
+            return [vector for vectors in executor.map(self._embed_batch, batches) for vector in vectors]
+
+    def embed_query(self, text):
+        # Backends may embed queries differently from documents (e.g. an input type)
+        return self._call(self.embeddings.embed_query, text)
+
+    def stats(self):
+        return {"calls": self.calls, "throttled": self.throttled, "concurrency": self.limiter.limit}
+
+
+class StubEmbeddings(Embeddings):
+    """Offline stand-in for an embedding backend.
+
+    Returns deterministic vectors derived from a hash of the text after
+    `latency` seconds, and raises StubThrottlingError when more than
+    `max_concurrent` calls are in flight, like a rate-limited service.
+    """
+
+    def __init__(self, dimensions=8, latency=0.05, max_concurrent=None, model_id="stub"):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.max_concurrent = max_concurrent
+        self.model_id = model_id
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [digest[index % len(digest)] / 255.0 for index in range(self.dimensions)]
+
+    def embed_documents(self, texts):
+        with self._lock:
+            if self.max_concurrent is not None and self._active >= self.max_concurrent:
+                raise StubThrottlingError("ThrottlingException: Too many requests")
+            self._active += 1
+        try:
+            time.sleep(self.latency)
+            return [self._vector(text) for text in texts]
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
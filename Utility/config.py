@@ -0,0 +1,245 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import yaml
+from presidio_analyzer import EntityRecognizer, Pattern, RecognizerResult
+from presidio_anonymizer import AnonymizerEngine
+from presidio_anonymizer.entities import OperatorConfig
+
+from Utility.combined_recognizer import CombinedPatternRecognizer
+
+logger = logging.getLogger(__name__)
+
+# Format of the configuration file this module reads
+CONFIG_VERSION = 1
+
+# Operator type that hands out keyed surrogates (needs a KeyedPseudonymizer)
+KEYED_OPERATOR = "keyed"
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def read_config(file_path):
+    """Read a YAML (.yaml/.yml) or JSON configuration file into a dict."""
+    with open(file_path) as config_file:
+        try:
+            if str(file_path).endswith((".yaml", ".yml")):
+                data = yaml.safe_load(config_file)
+            else:
+                data = json.load(config_file)
+        except (yaml.YAMLError, ValueError) as error:
+            # Syntax errors; JSONDecodeError and UnicodeDecodeError are ValueErrors
+            raise ConfigError(f"{file_path}: {error}") from error
+    if not isinstance(data, dict):
+        raise ConfigError(f"{file_path}: expected a mapping at the top level")
+    if data.get("version") != CONFIG_VERSION:
+        raise ConfigError(f"{file_path}: config version {data.get('version')!r}, expected {CONFIG_VERSION}")
+    return data
+
+
+def _operator(entity_type, spec, pseudonymizer):
+    if not isinstance(spec, dict):
+        raise ConfigError(f"operator for {entity_type} must be a mapping with a type, got {spec!r}")
+    spec = dict(spec)
+    operator_name = spec.pop("type", None)
+    if not operator_name:
+        raise ConfigError(f"operator for {entity_type} has no type")
+    if operator_name == KEYED_OPERATOR:
+        if pseudonymizer is None:
+            raise ConfigError(f"operator for {entity_type} is keyed, but no pseudonymizer was given")
+        return pseudonymizer.operators([entity_type])[entity_type]
+    return OperatorConfig(operator_name, spec)
+
+
+class ConfigSnapshot:
+    """One compiled version of the configuration: recognizer, entities and operators."""
+
+    def __init__(self, data, pseudonymizer=None, language="en", source=None):
+        self.revision = data.get("revision")
+        self.source = source
+        self.loaded_at = time.time()
+        try:
+            patterns = [
+                (entity_type, Pattern(name=spec["name"], regex=spec["regex"], score=float(spec.get("score", 0.5))))
+                for entity_type, specs in (data.get("patterns") or {}).items()
+                for spec in specs
+            ]
+            deny_lists = {entity_type: list(terms) for entity_type, terms in (data.get("deny_lists") or {}).items()}
+            # Constructing the recognizer compiles every regex
+            self.recognizer = CombinedPatternRecognizer(
+                patterns=patterns,
+                deny_lists=deny_lists,
+                deny_list_score=float(data.get("deny_list_score", 1.0)),
+                name="ConfiguredRecognizer",
+                supported_language=language,
+            )
+        except Exception as error:
+            # Missing keys, bad values and regexes that do not compile
+            raise ConfigError(f"invalid pattern: {error!r}") from error
+        self.entities = list(self.recognizer.supported_entities)
+
+        operators = data.get("operators") or {}
+        if not isinstance(operators, dict):
+            raise ConfigError(f"operators must map entity types to operators, got {operators!r}")
+        self.operators = {
+            entity_type: _operator(entity_type, spec, pseudonymizer)
+            for entity_type, spec in operators.items()
+        }
+        # Run each operator once, so bad parameters fail here and not in a
+        # request. Keyed operators are skipped: they take no parameters, and
+        # running one would put the dummy value into the pseudonymizer's index
+        engine = AnonymizerEngine()
+        for entity_type, operator in self.operators.items():
+            if operators[entity_type].get("type") == KEYED_OPERATOR:
+                continue
+            try:
+                engine.anonymize(
+                    text="value",
+                    analyzer_results=[RecognizerResult(entity_type, 0, 5, 1.0)],
+                    operators={entity_type: operator},
+                )
+            except Exception as error:
+                raise ConfigError(f"operator for {entity_type}: {error}") from error
+
+
+class ReloadableConfig:
+    """Recognizer patterns, deny-lists and operators from a file, reloadable at run time.
+
+    reload() reads and compiles the file into a new ConfigSnapshot while the
+    old one keeps serving, then swaps `snapshot` in one assignment. A file
+    that does not load or compile raises ConfigError and leaves the current
+    snapshot in place. The NLP model is not involved, so nothing else is
+    reloaded.
+
+    recognizer() returns a recognizer for an analyzer's registry that uses
+    the current snapshot, or the one pinned with use() in the calling
+    thread, so a request can be analyzed with the snapshot it started with.
+    """
+
+    def __init__(self, file_path, pseudonymizer=None, language="en"):
+        self.file_path = file_path
+        self.pseudonymizer = pseudonymizer
+        self.language = language
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self._mtime = None
+        self._pinned = threading.local()
+        self.snapshot = None
+        self.reload()
+
+    @property
+    def current(self):
+        """The snapshot pinned in this thread by use(), or else the latest one."""
+        return getattr(self._pinned, "snapshot", None) or self.snapshot
+
+    @contextmanager
+    def use(self, snapshot):
+        """Analyze with `snapshot` in this thread until the block ends, whatever reload() does meanwhile."""
+        previous = getattr(self._pinned, "snapshot", None)
+        self._pinned.snapshot = snapshot
+        try:
+            yield snapshot
+        finally:
+            self._pinned.snapshot = previous
+
+    def reload(self):
+        """Load the file again and swap in the new snapshot; returns it."""
+        with self._reload_lock:
+            mtime = os.path.getmtime(self.file_path)
+            snapshot = ConfigSnapshot(
+                read_config(self.file_path), self.pseudonymizer, self.language, source=self.file_path
+            )
+            self.snapshot = snapshot
+            self._mtime = mtime
+        logger.info("Loaded %s revision %s: %s", self.file_path, snapshot.revision, ", ".join(snapshot.entities))
+        return snapshot
+
+    def reload_if_changed(self):
+        """Reload if the file was modified since the last load; returns whether it did."""
+        try:
+            changed = os.path.getmtime(self.file_path) != self._mtime
+        except OSError:
+            return False
+        if changed:
+            self.reload()
+        return changed
+
+    def watch(self, interval=5.0):
+        """Check the file every `interval` seconds from a daemon thread and reload it when it changes."""
+        self.stop_watching()
+        self._stop.clear()
+
+        def poll():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except ConfigError as error:
+                    logger.error("Keeping revision %s: %s", self.snapshot.revision, error)
+                except Exception:
+                    # Anything else must not end the watcher either
+                    logger.exception("Keeping revision %s", self.snapshot.revision)
+
+        self._watcher = threading.Thread(target=poll, name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
+
+    @property
+    def entities(self):
+        return self.snapshot.entities
+
+    @property
+    def operators(self):
+        return self.snapshot.operators
+
+    def recognizer(self):
+        return ConfiguredRecognizer(self)
+
+
+class ConfiguredRecognizer(EntityRecognizer):
+    """Registry entry that forwards to the recognizer of the current snapshot.
+
+    Its supported entities follow the snapshot too, so entities added by a
+    reload are picked up by the analyzer without touching the registry.
+    "Current" is ReloadableConfig.current: a snapshot pinned with use()
+    wins over the latest one.
+    """
+
+    def __init__(self, config, name="ConfiguredRecognizer"):
+        self.config = config
+        super().__init__(
+            supported_entities=list(config.entities),
+            name=name,
+            supported_language=config.language,
+        )
+
+    @property
+    def supported_entities(self):
+        return self.config.current.entities
+
+    @supported_entities.setter
+    def supported_entities(self, value):
+        # Set by EntityRecognizer.__init__; the snapshot is the source of truth
+        pass
+
+    def load(self):
+        pass
+
+    def analyze(self, text, entities, nlp_artifacts=None):
+        results = self.config.current.recognizer.analyze(text, entities, nlp_artifacts)
+        # AnalyzerEngine matches results to registered recognizers by id
+        for result in results:
+            result.recognition_metadata[RecognizerResult.RECOGNIZER_IDENTIFIER_KEY] = self.id
+            result.recognition_metadata[RecognizerResult.RECOGNIZER_NAME_KEY] = self.name
+        return results
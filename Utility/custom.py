@@ -1,7 +1,8 @@
-import json
+import os
 from presidio_analyzer import AnalyzerEngine, PatternRecognizer, Pattern
 from presidio_anonymizer import AnonymizerEngine
 from presidio_anonymizer.entities import OperatorConfig, RecognizerResult
+from Utility.jsonl_writer import save_output
 
 # Define the custom pattern recognizer
 custom_pattern = Pattern(name="custom_entity_pattern", regex=r"nomura", score=0.5)
@@ -156,9 +157,9 @@ output = {
     ]
 }
 
-# Save the output to a JSON file
-with open("anonymized_data.json", "w") as json_file:
-    json.dump(output, json_file, indent=4)
+# Save the output to a JSON file; with ANONYMIZED_OUTPUT set to a
+# .jsonl(.gz/.zst) path, append it as one compact record instead
+save_output(output, os.getenv("ANONYMIZED_OUTPUT", "anonymized_data.json"))
 
 # Print the results
 print("Original Text:", text)
@@ -0,0 +1,292 @@
+import threading
+from contextlib import nullcontext
+
+from Utility.aho_corasick import AhoCorasick
+
+# Document metadata key holding the fake values that occur in a chunk
+MAPPING_KEYS = "mapping_keys"
+
+# LookupDeanonymizer groups fake values by this many leading characters
+_PREFIX_LENGTH = 3
+
+
+class Deanonymizer:
+    """Restore the original values in a text in one pass over it.
+
+    Builds an Aho-Corasick automaton over every fake value of a deanonymizer
+    mapping ({entity_type: {fake_value: original_value}}) once, instead of
+    trying each fake value against the text. Overlapping fake values are
+    resolved leftmost-longest, so "August 2012" wins over "2012".
+
+    With `source`, a callable returning the current mapping (for example
+    `lambda: anonymizer.deanonymizer_mapping`), the automaton is rebuilt
+    whenever the mapping has changed since the last call. `source` runs
+    under `source_lock` when one is given, so it can share the lock of
+    whatever writes the mapping. With `version`, a callable returning a
+    value that changes whenever the mapping may have changed, `source` is
+    only called when the version moves; without it, every call reads and
+    compares the whole mapping.
+    """
+
+    def __init__(self, mapping=None, source=None, source_lock=None, version=None):
+        self._source = source
+        self._source_lock = source_lock
+        self._version = version
+        self._lock = threading.Lock()
+        self._mapping = None
+        self._seen_version = None
+        self._automaton = AhoCorasick()
+        if mapping is not None:
+            self.update(mapping)
+
+    @classmethod
+    def from_anonymizer(cls, anonymizer, lock=None, version=None):
+        """Follow the deanonymizer mapping of a PresidioReversibleAnonymizer.
+
+        `lock` and `version` are those of whatever serializes the
+        anonymizer's calls (see questions.serialized), so the mapping is not
+        read while a call is adding to it.
+        """
+        return cls(source=lambda: anonymizer.deanonymizer_mapping, source_lock=lock, version=version)
+
+    def update(self, mapping, version=None):
+        """Rebuild the automaton for a new or changed mapping."""
+        automaton = AhoCorasick(
+            (fake_value, original)
+            for values in mapping.values()
+            for fake_value, original in values.items()
+        )
+        automaton.build()
+        with self._lock:
+            self._automaton = automaton
+            self._mapping = mapping
+            self._seen_version = version
+
+    def _refresh(self):
+        if self._source is None:
+            return
+        if self._version is not None and self._mapping is not None and self._version() == self._seen_version:
+            return
+        with self._source_lock or nullcontext():
+            version = None if self._version is None else self._version()
+            mapping = self._source()
+        if mapping != self._mapping:
+            self.update(mapping, version)
+        else:
+            self._seen_version = version
+
+    @property
+    def max_length(self):
+        """Length of the longest fake value."""
+        self._refresh()
+        return self._automaton.max_length
+
+    def deanonymize(self, text):
+        self._refresh()
+        automaton = self._automaton
+        if not len(automaton):
+            return text
+        pieces = []
+        cursor = 0
+        for start, end, original in automaton.find_longest(text):
+            pieces.append(text[cursor:start])
+            pieces.append(original)
+            cursor = end
+        pieces.append(text[cursor:])
+        return "".join(pieces)
+
+    __call__ = deanonymize
+
+    def stream(self, chunks):
+        """Deanonymize an iterable of text chunks (e.g. chain.stream() output) as it arrives.
+
+        Usable as the transform of a RunnableGenerator at the end of a chain.
+        """
+        streaming = StreamingDeanonymizer(self)
+        for chunk in chunks:
+            restored = streaming.feed(chunk)
+            if restored:
+                yield restored
+        restored = streaming.flush()
+        if restored:
+            yield restored
+
+    async def astream(self, chunks):
+        """Async version of stream(), for astream() and ainvoke() of a chain."""
+        streaming = StreamingDeanonymizer(self)
+        async for chunk in chunks:
+            restored = streaming.feed(chunk)
+            if restored:
+                yield restored
+        restored = streaming.flush()
+        if restored:
+            yield restored
+
+
+class StreamingDeanonymizer:
+    """Restore fake values in text that arrives in pieces, e.g. LLM tokens.
+
+    feed() returns the restored text that is final so far and keeps back
+    only the tail that could still be the start of a fake value, so a value
+    split across tokens is restored whole. The tail is at most as long as the
+    longest fake value and usually empty; flush() returns it at the end.
+    Matches are resolved leftmost-longest, as by Deanonymizer.deanonymize.
+    """
+
+    def __init__(self, deanonymizer):
+        deanonymizer._refresh()
+        # The automaton in use when the stream started, for the whole stream
+        self._automaton = deanonymizer._automaton
+        self._buffer = ""
+
+    def feed(self, chunk):
+        buffer = self._buffer + chunk
+        automaton = self._automaton
+        if not len(automaton):
+            self._buffer = ""
+            return buffer
+        # Matches starting before `hold` are complete and cannot grow longer
+        hold = len(buffer) - automaton.pending_length(buffer)
+        pieces = []
+        cursor = 0
+        for start, end, original in automaton.find_longest(buffer):
+            if start >= hold:
+                break
+            pieces.append(buffer[cursor:start])
+            pieces.append(original)
+            cursor = end
+        cut = max(cursor, hold)
+        pieces.append(buffer[cursor:cut])
+        self._buffer = buffer[cut:]
+        return "".join(pieces)
+
+    def flush(self):
+        buffer, self._buffer = self._buffer, ""
+        automaton = self._automaton
+        if not buffer or not len(automaton):
+            return buffer
+        pieces = []
+        cursor = 0
+        for start, end, original in automaton.find_longest(buffer):
+            pieces.append(buffer[cursor:start])
+            pieces.append(original)
+            cursor = end
+        pieces.append(buffer[cursor:])
+        return "".join(pieces)
+
+
+class LookupDeanonymizer:
+    """Restore fake values that keep being added, without rebuilding anything.
+
+    Deanonymizer compiles its automaton once per mapping, which is wasted
+    when every request adds fake values. This one keeps only the hash of
+    each fake value and the lengths of the fake values starting with each
+    three-character prefix, so add() is O(1) and the originals stay
+    wherever `original` looks them up (e.g. a KeyedPseudonymizer's index).
+    At each position those lengths are tried longest first, and `original`
+    is only called for text whose hash is known, so matches are
+    leftmost-longest as in Deanonymizer.
+
+    `original(fake_value)` returns the original value, or None.
+    """
+
+    def __init__(self, original, fake_values=()):
+        self._original = original
+        self._lock = threading.Lock()
+        self._hashes = set()
+        # Prefix -> lengths of the fake values starting with it, longest first;
+        # fake values shorter than the prefix are their own prefix
+        self._lengths = {}
+        self._short = False
+        for fake_value in fake_values:
+            self.add(fake_value)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, fake_value):
+        if not fake_value:
+            return
+        self._hashes.add(hash(fake_value))
+        prefix = fake_value[:_PREFIX_LENGTH]
+        if len(fake_value) in self._lengths.get(prefix, ()):
+            return
+        with self._lock:
+            lengths = self._lengths.get(prefix, ())
+            if len(fake_value) not in lengths:
+                # Replaced, not changed in place, so readers need no lock
+                self._lengths[prefix] = tuple(sorted({*lengths, len(fake_value)}, reverse=True))
+                self._short = self._short or len(fake_value) < _PREFIX_LENGTH
+
+    def deanonymize(self, text):
+        lengths = self._lengths
+        if not lengths:
+            return text
+        hashes = self._hashes
+        short = range(_PREFIX_LENGTH - 1, 0, -1) if self._short else ()
+        pieces = []
+        cursor = 0
+        position = 0
+        while position < len(text):
+            candidates = lengths.get(text[position:position + _PREFIX_LENGTH], ())
+            for length in short:
+                candidates += lengths.get(text[position:position + length], ())
+            for length in candidates:
+                candidate = text[position:position + length]
+                if len(candidate) == length and hash(candidate) in hashes:
+                    restored = self._original(candidate)
+                    if restored is not None:
+                        pieces.append(text[cursor:position])
+                        pieces.append(restored)
+                        cursor = position = position + length
+                        break
+            else:
+                position += 1
+        pieces.append(text[cursor:])
+        return "".join(pieces)
+
+    __call__ = deanonymize
+
+
+def chunk_mapping_keys(chunks, mapping):
+    """Return, for each chunk, the {entity_type: [fake values]} of `mapping` that occur in it.
+
+    Stored with each chunk (under MAPPING_KEYS), it lets a query restore the
+    retrieved chunks with scoped_mapping() without loading the whole map.
+    """
+    automaton = AhoCorasick(
+        (fake_value, entity_type)
+        for entity_type, values in mapping.items()
+        for fake_value in values
+    )
+    automaton.build()
+    keys = []
+    for chunk in chunks:
+        found = {}
+        for start, end, entity_type in automaton.find_longest(chunk):
+            found.setdefault(entity_type, set()).add(chunk[start:end])
+        keys.append({entity_type: sorted(values) for entity_type, values in found.items()})
+    return keys
+
+
+def scoped_mapping(documents, original):
+    """Build the deanonymizer mapping of just the fake values in `documents`.
+
+    `original(entity_type, fake_value)` returns the original value (or None),
+    e.g. MappingStore.original with the arguments swapped. Returns None if a
+    document has no MAPPING_KEYS metadata (indexed before they were stored),
+    in which case the whole mapping is needed.
+    """
+    mapping = {}
+    for document in documents:
+        keys = document.metadata.get(MAPPING_KEYS)
+        if keys is None:
+            return None
+        for entity_type, fake_values in keys.items():
+            values = mapping.setdefault(entity_type, {})
+            for fake_value in fake_values:
+                if fake_value not in values:
+                    restored = original(entity_type, fake_value)
+                    if restored is not None:
+                        values[fake_value] = restored
+    return mapping
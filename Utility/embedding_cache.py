@@ -0,0 +1,138 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-addressed cache in front of an embedding backend.
+
+    Vectors are stored in a local SQLite file keyed by a hash of the model id
+    and the text, so re-embedding unchanged chunks costs a lookup instead of a
+    backend call. With `s3_client`, `bucket` and `s3_key` the file is fetched
+    from S3 when it is missing locally and uploaded again by sync().
+    """
+
+    def __init__(self, embeddings, model_id=None, path="embedding_cache.sqlite",
+                 s3_client=None, bucket=None, s3_key=None):
+        self.embeddings = embeddings
+        self.model_id = model_id or getattr(embeddings, "model_id", None) or type(embeddings).__name__
+        self.path = path
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.s3_key = s3_key
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self._mirrored and not os.path.exists(path):
+            self._download()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._connection.commit()
+
+    @property
+    def _mirrored(self):
+        return bool(self.s3_client and self.bucket and self.s3_key)
+
+    def _download(self):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.s3_client.download_file(self.bucket, self.s3_key, self.path)
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+                raise
+
+    def _key(self, text, kind):
+        digest = hashlib.sha256()
+        for part in (self.model_id, kind, text):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for offset in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[offset:offset + _LOOKUP_BATCH]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def _store(self, items):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items],
+            )
+            self._connection.commit()
+
+    def embed_documents(self, texts):
+        keys = [self._key(text, "document") for text in texts]
+        cached = self._lookup(set(keys))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        with self._lock:
+            self.hits += len(texts) - sum(1 for key in keys if key in missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self._store(new_items)
+            cached.update(new_items)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._key(text, "query")
+        cached = self._lookup([key])
+        with self._lock:
+            if key in cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if key in cached:
+            return cached[key]
+        vector = self.embeddings.embed_query(text)
+        self._store([(key, vector)])
+        return vector
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+    def sync(self):
+        """Upload the cache file to S3, if a mirror is configured."""
+        if not self._mirrored:
+            return
+        with self._lock:
+            self._connection.commit()
+            self.s3_client.upload_file(self.path, self.bucket, self.s3_key)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import tempfile
+
+from botocore.exceptions import ClientError
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+# Files written by FAISS.save_local(folder, index_name="index")
+_INDEX_FILES = ("index.faiss", "index.pkl")
+
+
+def chunk_ids(source, chunks):
+    """Stable ids for the chunks of a document: source + content hash.
+
+    Repeated identical chunks get an occurrence counter, so the same document
+    always produces the same ids and an edited one only changes the ids of
+    the chunks that changed.
+    """
+    seen = {}
+    ids = []
+    for chunk in chunks:
+        digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:20]
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        ids.append(f"{source}:{digest}:{occurrence}")
+    return ids
+
+
+def source_ids(store, source):
+    """Return the docstore ids of every chunk indexed for `source`."""
+    ids = set()
+    for doc_id in store.index_to_docstore_id.values():
+        document = store.docstore.search(doc_id)
+        if isinstance(document, Document) and document.metadata.get("source") == source:
+            ids.add(doc_id)
+    return ids
+
+
+def upsert_document(store, embeddings, source, chunks, metadata=None, chunk_metadata=None):
+    """Index the chunks of `source`, replacing the chunks of a previous version.
+
+    Only chunks whose ids are not in the index yet are embedded; chunks that
+    belonged to the old version of the document and are gone are deleted.
+    `metadata` goes on every chunk and `chunk_metadata`, a list parallel to
+    `chunks`, on each chunk in turn. Returns (store, added, removed); `store`
+    is created if it was None.
+    """
+    ids = chunk_ids(source, chunks)
+    chunk_metadata = chunk_metadata or [{}] * len(chunks)
+    documents = [
+        Document(
+            page_content=chunk,
+            metadata={**(metadata or {}), **extra, "source": source, "chunk_id": chunk_id},
+        )
+        for chunk, chunk_id, extra in zip(chunks, ids, chunk_metadata)
+    ]
+
+    if store is None:
+        if not documents:
+            return None, 0, 0
+        return FAISS.from_documents(documents, embeddings, ids=ids), len(documents), 0
+
+    existing = source_ids(store, source)
+    stale = existing.difference(ids)
+    if stale:
+        store.delete(list(stale))
+
+    new_documents = [document for document in documents if document.metadata["chunk_id"] not in existing]
+    if new_documents:
+        store.add_documents(new_documents, ids=[document.metadata["chunk_id"] for document in new_documents])
+    return store, len(new_documents), len(stale)
+
+
+class VersionedIndexStore:
+    """FAISS indexes kept in S3 as numbered versions.
+
+    Each save writes `{prefix}/v{version}/index.faiss` and `index.pkl`, then
+    moves the `{prefix}/LATEST` pointer; readers always load a complete
+    version, and older versions stay available for rollback.
+    """
+
+    def __init__(self, s3_client, bucket, prefix, local_dir=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.local_dir = local_dir or tempfile.gettempdir()
+
+    def _key(self, version, name):
+        return f"{self.prefix}/v{version:06d}/{name}"
+
+    def latest_version(self):
+        """Return the latest saved version number, or 0 if nothing was saved."""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=f"{self.prefix}/LATEST")
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return 0
+            raise
+        return int(response["Body"].read().decode("utf-8").strip())
+
+    def load(self, embeddings, version=None):
+        """Return (store, version); store is None if nothing was saved yet."""
+        version = self.latest_version() if version is None else version
+        if not version:
+            return None, 0
+        folder = os.path.join(self.local_dir, f"faiss_v{version:06d}")
+        os.makedirs(folder, exist_ok=True)
+        for name in _INDEX_FILES:
+            self.s3_client.download_file(self.bucket, self._key(version, name), os.path.join(folder, name))
+        # The pickle was written by save() below, from our own bucket
+        store = FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
+        return store, version
+
+    def save(self, store, previous_version=None):
+        """Upload `store` as the next version and point LATEST at it."""
+        previous_version = self.latest_version() if previous_version is None else previous_version
+        version = previous_version + 1
+        folder = os.path.join(self.local_dir, f"faiss_v{version:06d}")
+        store.save_local(folder)
+        for name in _INDEX_FILES:
+            self.s3_client.upload_file(os.path.join(folder, name), self.bucket, self._key(version, name))
+        self.s3_client.put_object(Bucket=self.bucket, Key=f"{self.prefix}/LATEST", Body=str(version).encode("utf-8"))
+        return version
@@ -0,0 +1,177 @@
+import gzip
+import json
+import os
+import zlib
+
+import orjson
+
+# Output paths ending in these are written as JSON Lines
+JSONL_SUFFIXES = (".jsonl", ".jsonl.gz", ".jsonl.zst")
+
+
+def is_jsonl(file_path):
+    return str(file_path).endswith(JSONL_SUFFIXES)
+
+
+# Uncompressed bytes gathered before a compressed frame is written
+FRAME_SIZE = 1 << 20
+
+# Compressed files are read back in blocks of this size
+_READ_BLOCK = 1 << 20
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Writing .zst files needs the zstandard package (pip install zstandard)") from None
+    return zstandard
+
+
+def _codec(file_path):
+    """Return (compress, new_decompressor, decode_errors) for a compressed path, or None."""
+    file_path = str(file_path)
+    if file_path.endswith(".gz"):
+        # wbits=31: one gzip member per decompressor
+        return gzip.compress, lambda: zlib.decompressobj(wbits=31), (zlib.error,)
+    if file_path.endswith(".zst"):
+        zstandard = _zstandard()
+        return (
+            lambda data: zstandard.ZstdCompressor().compress(data),
+            lambda: zstandard.ZstdDecompressor().decompressobj(),
+            (zstandard.ZstdError,),
+        )
+    return None
+
+
+def _whole_frames(raw, new_decompressor, decode_errors):
+    """Yield (end offset, records) for each complete gzip member or zstd frame in `raw`.
+
+    Stops at a frame cut short at the end of the file; raises ValueError
+    if the data cannot be decoded at all.
+    """
+    decompressor = new_decompressor()
+    consumed = 0
+    records = 0
+    data = raw.read(_READ_BLOCK)
+    while data:
+        try:
+            records += decompressor.decompress(data).count(b"\n")
+        except decode_errors as error:
+            raise ValueError(f"{raw.name} is corrupt after {consumed} bytes") from error
+        if not decompressor.eof:
+            consumed += len(data)
+            data = raw.read(_READ_BLOCK)
+            continue
+        unused = decompressor.unused_data
+        consumed += len(data) - len(unused)
+        yield consumed, records
+        decompressor = new_decompressor()
+        records = 0
+        data = unused or raw.read(_READ_BLOCK)
+
+
+def count_records(file_path):
+    """Return the number of complete records in a JSONL file (0 if it does not exist).
+
+    A file whose end was cut short (a run killed mid-write) is truncated
+    back to the last complete record: for a plain file the last whole line,
+    for a compressed one the last whole gzip member or zstd frame, which
+    JsonlWriter only writes with whole records in it.
+    """
+    if not os.path.exists(file_path):
+        return 0
+    codec = _codec(file_path)
+    count = 0
+    complete = 0
+    if codec is None:
+        with open(file_path, "rb") as records:
+            for line in records:
+                if not line.endswith(b"\n"):
+                    break
+                count += 1
+                complete += len(line)
+    else:
+        _, new_decompressor, decode_errors = codec
+        with open(file_path, "rb") as raw:
+            for complete, records in _whole_frames(raw, new_decompressor, decode_errors):
+                count += records
+    if os.path.getsize(file_path) != complete:
+        os.truncate(file_path, complete)
+    return count
+
+
+class JsonlWriter:
+    """Write records one compact orjson line at a time.
+
+    Nothing is kept after a record is written, so memory does not depend on
+    the number of records. `.gz` and `.zst` paths are compressed: records
+    are gathered into FRAME_SIZE bytes and each batch is written as its own
+    gzip member or zstd frame, which a plain reader of either format reads
+    back as one stream. With `append` new records go after the existing
+    ones, and with `resume` the number of records already in the file is in
+    `skip`, so a caller can skip that many inputs and carry on where a
+    killed run stopped; a killed run loses at most its last, unwritten
+    frame.
+    """
+
+    def __init__(self, file_path, append=False, resume=False, frame_size=FRAME_SIZE):
+        self.file_path = file_path
+        self.skip = count_records(file_path) if resume else 0
+        self.count = 0
+        codec = _codec(file_path)
+        self._compress = None if codec is None else codec[0]
+        self.frame_size = frame_size
+        self._pending = []
+        self._pending_size = 0
+        mode = "ab" if append or resume else "wb"
+        self._file = open(file_path, mode, buffering=1 << 20 if self._compress is None else 0)
+
+    def write(self, record):
+        line = orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        self.count += 1
+        if self._compress is None:
+            self._file.write(line)
+            return
+        self._pending.append(line)
+        self._pending_size += len(line)
+        if self._pending_size >= self.frame_size:
+            self._write_frame()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self.count
+
+    def _write_frame(self):
+        if not self._pending:
+            return
+        self._file.write(self._compress(b"".join(self._pending)))
+        self._pending = []
+        self._pending_size = 0
+
+    def flush(self):
+        self._write_frame()
+        self._file.flush()
+
+    def close(self):
+        try:
+            self._write_frame()
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def save_output(output, file_path="anonymized_data.json"):
+    """Append `output` as one record to a JSONL path, or write it as indented JSON otherwise."""
+    if is_jsonl(file_path):
+        with JsonlWriter(file_path, append=True) as writer:
+            writer.write(output)
+    else:
+        with open(file_path, "w") as json_file:
+            json.dump(output, json_file, indent=4)
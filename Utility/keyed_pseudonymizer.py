@@ -0,0 +1,220 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import sys
+import threading
+
+from Crypto.Cipher import AES
+from faker import Faker
+from presidio_anonymizer.entities import OperatorConfig
+from presidio_anonymizer.operators import Custom
+
+from Utility.surrogate_generators import ENUMERATED_SPACES, FALLBACK_GENERATOR, WIDE_GENERATORS
+
+logger = logging.getLogger(__name__)
+
+# presidio_anonymizer 2.2.355 validates a custom operator by calling its
+# lambda with a dummy value from Custom.validate on every anonymize call
+_VALIDATE_CODE = Custom.validate.__code__
+
+
+def _derive_key(secret, purpose):
+    return hmac.new(secret, purpose, hashlib.sha256).digest()
+
+
+class KeyedPseudonymizer:
+    """Derive surrogates from a secret instead of a shared mapping.
+
+    The surrogate of a value is generated by a per-type Faker provider seeded
+    with HMAC(secret, entity type, value), so every worker holding the same
+    secret (and the same Faker version) picks the same surrogate for the same
+    value without talking to the others.
+
+    For the way back, every surrogate handed out is recorded in `index` as
+    {entity_type: {surrogate: token}}, where the token is the original value
+    encrypted with AES-SIV under a key derived from the secret. Encryption is
+    deterministic, so indexes from different workers merge by plain union and
+    the secret is all that is needed to read them.
+
+    A surrogate depends on nothing but the secret, the entity type and the
+    value. For types whose values can all be listed (ENUMERATED_SPACES, such
+    as the 1,440 TIME values) it is the value's image under a keyed
+    permutation of the list, so values in the space never share one. Other
+    types draw from Faker (WIDE_GENERATORS by default), where two values can
+    still land on one surrogate;
+    the first keeps it in the index, and every surrogate that stands for
+    two values, found in surrogate() or merge_index(), is listed in
+    `conflicts` as {entity_type: {surrogate, ...}}, counted in `collisions`
+    and logged.
+    """
+
+    def __init__(self, secret, generators=None, locale="en_US", memo_size=100_000, spaces=None):
+        if isinstance(secret, str):
+            secret = secret.encode("utf-8")
+        self._mac_key = _derive_key(secret, b"pseudonym")
+        # 256-bit key for AES-SIV (two AES-128 keys)
+        self._index_key = _derive_key(secret, b"reverse-index")
+        self.generators = dict(WIDE_GENERATORS if generators is None else generators)
+        self.index = {}
+        self.spaces = dict(ENUMERATED_SPACES if spaces is None else spaces)
+        self.collisions = 0
+        self.conflicts = {}
+        self.memo_size = memo_size
+        # Values seen recently; entities repeat a lot within a corpus
+        self._memo = {}
+        # Index entries handed out since the last take_used()
+        self._used = {}
+        self._permutations = {}
+        self._faker = Faker(locale)
+        self._lock = threading.Lock()
+
+    def _mac(self, *parts):
+        message = b"\0".join(part.encode("utf-8") for part in parts)
+        return hmac.new(self._mac_key, message, hashlib.sha256).digest()
+
+    def _seed(self, entity_type, value):
+        return int.from_bytes(self._mac(entity_type, value)[:16], "big")
+
+    def _permutation(self, entity_type):
+        # {value: surrogate} over an enumerated space; built once per type
+        permutation = self._permutations.get(entity_type)
+        if permutation is None:
+            values = self.spaces[entity_type][0]
+            shuffled = sorted(values, key=lambda value: self._mac("permutation", entity_type, value))
+            permutation = self._permutations[entity_type] = dict(zip(values, shuffled))
+        return permutation
+
+    def _record(self, entity_type, surrogate, token):
+        # Caller holds the lock. The first value keeps a surrogate
+        if self.index.setdefault(entity_type, {}).setdefault(surrogate, token) == token:
+            return
+        conflicts = self.conflicts.setdefault(entity_type, set())
+        if surrogate not in conflicts:
+            conflicts.add(surrogate)
+            self.collisions += 1
+            logger.warning("Two %s values share the surrogate %r; the first one keeps it", entity_type, surrogate)
+
+    def _encrypt(self, entity_type, value):
+        cipher = AES.new(self._index_key, AES.MODE_SIV)
+        cipher.update(entity_type.encode("utf-8"))
+        ciphertext, tag = cipher.encrypt_and_digest(value.encode("utf-8"))
+        return base64.urlsafe_b64encode(tag + ciphertext).decode("ascii")
+
+    def _decrypt(self, entity_type, token):
+        raw = base64.urlsafe_b64decode(token.encode("ascii"))
+        cipher = AES.new(self._index_key, AES.MODE_SIV)
+        cipher.update(entity_type.encode("utf-8"))
+        return cipher.decrypt_and_verify(raw[16:], raw[:16]).decode("utf-8")
+
+    def surrogate(self, entity_type, value):
+        """Return the surrogate of `value` and record it in the index."""
+        memo = self._memo.get((entity_type, value))
+        if memo is not None:
+            surrogate, token = memo
+            with self._lock:
+                self._used.setdefault(entity_type, {})[surrogate] = token
+            return surrogate
+
+        token = self._encrypt(entity_type, value)
+        canonical = None
+        if entity_type in self.spaces:
+            canonical = self.spaces[entity_type][1](value)
+        with self._lock:
+            if canonical is not None:
+                surrogate = self._permutation(entity_type)[canonical]
+            else:
+                self._faker.seed_instance(self._seed(entity_type, value))
+                surrogate = str(self.generators.get(entity_type, FALLBACK_GENERATOR)(self._faker))
+            self._record(entity_type, surrogate, token)
+            if len(self._memo) >= self.memo_size:
+                self._memo.clear()
+            self._memo[(entity_type, value)] = (surrogate, token)
+            self._used.setdefault(entity_type, {})[surrogate] = token
+        return surrogate
+
+    def take_used(self):
+        """Return the index entries handed out since the last call, in the index format.
+
+        Includes values served from the memo, so it covers every surrogate
+        written since then, e.g. into one shard of a corpus.
+        """
+        with self._lock:
+            used, self._used = self._used, {}
+        return used
+
+    def reserve(self, mapping):
+        """Add a {entity_type: {surrogate: original}} mapping to the index.
+
+        Surrogates handed out by another anonymizer (e.g. a stored Faker
+        map) then keep their value, and a keyed surrogate that lands on one
+        of them for another value is reported in `conflicts`.
+        """
+        self.merge_index({
+            entity_type: {surrogate: self._encrypt(entity_type, original) for surrogate, original in values.items()}
+            for entity_type, values in mapping.items()
+        })
+
+    def operators(self, entity_types=None):
+        """Presidio custom operators producing keyed surrogates, one per entity type."""
+        entity_types = self.generators.keys() if entity_types is None else entity_types
+        return {
+            entity_type: OperatorConfig("custom", {"lambda": _KeyedOperator(self, entity_type)})
+            for entity_type in entity_types
+        }
+
+    def reveal(self, entity_type, surrogate, index=None):
+        """Return the original value behind a surrogate, or None if it is unknown."""
+        token = (self.index if index is None else index).get(entity_type, {}).get(surrogate)
+        return None if token is None else self._decrypt(entity_type, token)
+
+    def deanonymizer_mapping(self, index=None):
+        """Decrypt an index into the {entity_type: {surrogate: original}} mapping format."""
+        index = self.index if index is None else index
+        return {
+            entity_type: {surrogate: self._decrypt(entity_type, token) for surrogate, token in tokens.items()}
+            for entity_type, tokens in index.items()
+        }
+
+    def merge_index(self, other, conflicts=None):
+        """Add the entries of another worker's index to this one.
+
+        Entries already here win; a surrogate that `other` has for a
+        different value is reported like a collision in surrogate(), and so
+        are the `conflicts` the other worker found itself.
+        """
+        with self._lock:
+            for entity_type, tokens in other.items():
+                for surrogate, token in tokens.items():
+                    self._record(entity_type, surrogate, token)
+            for entity_type, surrogates in (conflicts or {}).items():
+                known = self.conflicts.setdefault(entity_type, set())
+                self.collisions += len(set(surrogates) - known)
+                known.update(surrogates)
+
+    def save_index(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump(self.index, f, separators=(",", ":"))
+
+    def load_index(self, file_path):
+        with open(file_path) as f:
+            self.merge_index(json.load(f))
+
+
+class _KeyedOperator:
+    """Lambda of a keyed custom operator.
+
+    Presidio's validation call from Custom.validate is answered without
+    recording anything, so the dummy value stays out of the index while a
+    real value that happens to equal it is still replaced.
+    """
+
+    def __init__(self, pseudonymizer, entity_type):
+        self.pseudonymizer = pseudonymizer
+        self.entity_type = entity_type
+
+    def __call__(self, value):
+        if sys._getframe(1).f_code is _VALIDATE_CODE:
+            return value
+        return self.pseudonymizer.surrogate(self.entity_type, value)
@@ -1,7 +1,9 @@
-import json
-from presidio_analyzer import AnalyzerEngine, PatternRecognizer, Pattern
+import os
+from presidio_analyzer import AnalyzerEngine, Pattern
 from presidio_anonymizer import AnonymizerEngine
 from presidio_anonymizer.entities import OperatorConfig, RecognizerResult
+from Utility.combined_recognizer import CombinedPatternRecognizer
+from Utility.jsonl_writer import save_output
 
 # Define custom patterns for legal terms
 legal_patterns = [
@@ -11,13 +13,12 @@ legal_patterns = [
     # Add more patterns as needed
 ]
 
-# Create custom recognizers for legal terms
-legal_recognizers = [PatternRecognizer(supported_entity="LEGAL_TERM", patterns=[pattern]) for pattern in legal_patterns]
+# Create one recognizer that finds all legal terms in a single scan
+legal_recognizer = CombinedPatternRecognizer(patterns=[("LEGAL_TERM", pattern) for pattern in legal_patterns])
 
-# Initialize the Presidio analyzer and add the custom recognizers
+# Initialize the Presidio analyzer and add the custom recognizer
 analyzer = AnalyzerEngine()
-for recognizer in legal_recognizers:
-    analyzer.registry.add_recognizer(recognizer)
+analyzer.registry.add_recognizer(legal_recognizer)
 
 # Initialize the Presidio anonymizer
 anonymizer = AnonymizerEngine()
@@ -162,9 +163,9 @@ output = {
     ]
 }
 
-# Save the output to a JSON file
-with open("anonymized_data.json", "w") as json_file:
-    json.dump(output, json_file, indent=4)
+# Save the output to a JSON file; with ANONYMIZED_OUTPUT set to a
+# .jsonl(.gz/.zst) path, append it as one compact record instead
+save_output(output, os.getenv("ANONYMIZED_OUTPUT", "anonymized_data.json"))
 
 # Print the results
 print("Original Text:", text)
@@ -0,0 +1,306 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import marisa_trie
+
+# Files of a saved store, inside one directory
+SURROGATES_FILE = "surrogates.marisa"
+ORIGINALS_FILE = "originals.marisa"
+META_FILE = "meta.json"
+STORE_FILES = (SURROGATES_FILE, ORIGINALS_FILE, META_FILE)
+FORMAT_VERSION = 1
+
+# Separates the entity type from the value inside a trie value
+_SEPARATOR = b"\0"
+
+
+def _pack(entity_type, value):
+    return entity_type.encode("utf-8") + _SEPARATOR + value.encode("utf-8")
+
+
+def _unpack(packed):
+    entity_type, _, value = packed.partition(_SEPARATOR)
+    return entity_type.decode("utf-8"), value.decode("utf-8")
+
+
+def _local_directory(local_dir, digest):
+    return os.path.join(local_dir, f"mapping_store_{digest}")
+
+
+def _publish(staging, directory):
+    # Move a fully written store into place; the directory name is its
+    # digest, so if another process got there first it holds the same files
+    try:
+        os.replace(staging, directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+        shutil.rmtree(staging)
+
+
+def _scan(trie, starts, max_length, text):
+    # Leftmost-longest, like Deanonymizer: at each position take the longest
+    # key the text continues with, then carry on after it
+    position = 0
+    while position < len(text):
+        if text[position] in starts:
+            keys = trie.prefixes(text[position:position + max_length])
+            if keys:
+                key = max(keys, key=len)
+                yield position, position + len(key), key
+                position += len(key)
+                continue
+        position += 1
+
+
+class MappingStore:
+    """Read-only deanonymizer mapping held in two marisa tries.
+
+    One trie maps every surrogate to its (entity type, original) and the
+    other every original to its (entity type, surrogate), so lookups work in
+    both directions. The tries are succinct and can be memory-mapped from
+    disk: query workers that load() the same saved store share its pages
+    through the OS page cache instead of each holding the mapping as nested
+    Python dicts.
+
+    deanonymize() and pseudonymize() replace surrogates or originals in a
+    text with the same leftmost-longest rule as Deanonymizer, using prefix
+    lookups in the tries.
+    """
+
+    def __init__(self, surrogates, originals, meta):
+        self._surrogates = surrogates
+        self._originals = originals
+        self.meta = meta
+        self._surrogate_starts = frozenset(meta["surrogate_starts"])
+        self._original_starts = frozenset(meta["original_starts"])
+
+    @classmethod
+    def build(cls, mapping):
+        """Build a store from a {entity_type: {surrogate: original}} mapping."""
+        forward = []
+        reverse = []
+        for entity_type, values in mapping.items():
+            for surrogate, original in values.items():
+                if surrogate and original:
+                    forward.append((surrogate, _pack(entity_type, original)))
+                    reverse.append((original, _pack(entity_type, surrogate)))
+        meta = {
+            "version": FORMAT_VERSION,
+            "entries": len(forward),
+            "entity_types": sorted(mapping),
+            "max_surrogate_length": max((len(key) for key, _ in forward), default=0),
+            "max_original_length": max((len(key) for key, _ in reverse), default=0),
+            "surrogate_starts": "".join(sorted({key[0] for key, _ in forward})),
+            "original_starts": "".join(sorted({key[0] for key, _ in reverse})),
+        }
+        return cls(marisa_trie.BytesTrie(forward), marisa_trie.BytesTrie(reverse), meta)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._surrogates.save(os.path.join(directory, SURROGATES_FILE))
+        self._originals.save(os.path.join(directory, ORIGINALS_FILE))
+        with open(os.path.join(directory, META_FILE), "w") as meta_file:
+            json.dump(self.meta, meta_file)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Open a saved store; with `mmap` the tries are mapped rather than read into memory."""
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{directory} has mapping store format {meta.get('version')}, expected {FORMAT_VERSION}")
+        tries = []
+        for file_name in (SURROGATES_FILE, ORIGINALS_FILE):
+            trie = marisa_trie.BytesTrie()
+            file_path = os.path.join(directory, file_name)
+            tries.append(trie.mmap(file_path) if mmap else trie.load(file_path))
+        return cls(tries[0], tries[1], meta)
+
+    def upload(self, s3_client, bucket, prefix, local_dir=None):
+        """Save the store and upload it to S3 under `prefix`; return its digest.
+
+        The files go to `{prefix}/{digest}/`, named by a hash of their
+        content, and `{prefix}/LATEST` is pointed at them last, so download()
+        always gets the three files of one store. The local copy is kept in
+        `local_dir` (the temp directory by default), where download() finds
+        it without fetching it again.
+        """
+        local_dir = local_dir or tempfile.gettempdir()
+        os.makedirs(local_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix="mapping_store_", dir=local_dir)
+        self.save(staging)
+        digest = hashlib.sha256()
+        for name in STORE_FILES:
+            with open(os.path.join(staging, name), "rb") as store_file:
+                digest.update(store_file.read())
+        digest = digest.hexdigest()[:20]
+        directory = _local_directory(local_dir, digest)
+        _publish(staging, directory)
+
+        prefix = prefix.rstrip("/")
+        for name in STORE_FILES:
+            s3_client.upload_file(os.path.join(directory, name), bucket, f"{prefix}/{digest}/{name}")
+        s3_client.put_object(Bucket=bucket, Key=f"{prefix}/LATEST", Body=digest.encode("utf-8"))
+        return digest
+
+    @classmethod
+    def download(cls, s3_client, bucket, prefix, local_dir=None, mmap=True):
+        """Load the store last uploaded under `prefix`; None if there is none.
+
+        The files are fetched into `local_dir` once per store, so query
+        workers on one host memory-map the same copy.
+        """
+        from botocore.exceptions import ClientError
+
+        prefix = prefix.rstrip("/")
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=f"{prefix}/LATEST")
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise
+        digest = response["Body"].read().decode("utf-8").strip()
+        local_dir = local_dir or tempfile.gettempdir()
+        directory = _local_directory(local_dir, digest)
+        if not os.path.isdir(directory):
+            os.makedirs(local_dir, exist_ok=True)
+            staging = tempfile.mkdtemp(prefix="mapping_store_", dir=local_dir)
+            for name in STORE_FILES:
+                s3_client.download_file(bucket, f"{prefix}/{digest}/{name}", os.path.join(staging, name))
+            _publish(staging, directory)
+        return cls.load(directory, mmap=mmap)
+
+    def __len__(self):
+        return self.meta["entries"]
+
+    @staticmethod
+    def _lookup(trie, key, entity_type):
+        for packed in trie.get(key, ()):
+            found_type, value = _unpack(packed)
+            if entity_type is None or found_type == entity_type:
+                return found_type, value
+        return None
+
+    def original(self, surrogate, entity_type=None):
+        """Return the original behind `surrogate`, or None if it is unknown."""
+        found = self._lookup(self._surrogates, surrogate, entity_type)
+        return None if found is None else found[1]
+
+    def surrogate(self, original, entity_type=None):
+        """Return the surrogate already used for `original`, or None."""
+        found = self._lookup(self._originals, original, entity_type)
+        return None if found is None else found[1]
+
+    def surrogates_with_prefix(self, prefix):
+        """Return (surrogate, entity_type, original) for every surrogate starting with `prefix`."""
+        return [(key, *_unpack(packed)) for key, packed in self._surrogates.items(prefix)]
+
+    def originals_with_prefix(self, prefix):
+        """Return (original, entity_type, surrogate) for every original starting with `prefix`."""
+        return [(key, *_unpack(packed)) for key, packed in self._originals.items(prefix)]
+
+    def _replace(self, text, trie, starts, max_length):
+        pieces = []
+        cursor = 0
+        for start, end, key in _scan(trie, starts, max_length, text):
+            pieces.append(text[cursor:start])
+            pieces.append(_unpack(trie[key][0])[1])
+            cursor = end
+        pieces.append(text[cursor:])
+        return "".join(pieces)
+
+    def deanonymize(self, text):
+        """Replace every surrogate in `text` with its original."""
+        return self._replace(text, self._surrogates, self._surrogate_starts, self.meta["max_surrogate_length"])
+
+    def pseudonymize(self, text):
+        """Replace every known original in `text` with its surrogate."""
+        return self._replace(text, self._originals, self._original_starts, self.meta["max_original_length"])
+
+    __call__ = deanonymize
+
+    def reuse_known(self, operators, max_attempts=100):
+        """Wrap custom operators so values already in the store keep their surrogate.
+
+        Operators that are not "custom" are returned unchanged. Handing the
+        result to PresidioReversibleAnonymizer.add_operators lets a query
+        anonymizer start from an empty mapping instead of loading this one.
+        A new value never gets a surrogate the store already uses for
+        another value: the operator draws again, up to `max_attempts` times,
+        and raises ValueError after that. Redraws call the operator without
+        the value, since operators that keep one surrogate per value (see
+        SurrogatePools.take) would repeat the same one; the value keeps the
+        surrogate it was redrawn to.
+        """
+        # Imported here so deanonymizing from a store does not load Presidio
+        from presidio_anonymizer.entities import OperatorConfig
+
+        wrapped = {}
+        for entity_type, config in operators.items():
+            generate = config.params.get("lambda") if config.operator_name == "custom" else None
+            if generate is None:
+                wrapped[entity_type] = config
+                continue
+
+            # Values whose first surrogate was in the store, and what they got instead
+            redrawn = {}
+
+            def operator(value, entity_type=entity_type, generate=generate, redrawn=redrawn):
+                known = self.surrogate(value, entity_type)
+                if known is None:
+                    known = redrawn.get(value)
+                if known is not None:
+                    return known
+                candidate = generate(value)
+                for _ in range(max_attempts - 1):
+                    if self.original(candidate, entity_type) is None:
+                        return candidate
+                    candidate = redrawn[value] = generate(None)
+                if self.original(candidate, entity_type) is None:
+                    return candidate
+                del redrawn[value]
+                raise ValueError(f"no {entity_type} surrogate outside the store after {max_attempts} draws")
+
+            wrapped[entity_type] = OperatorConfig("custom", {**config.params, "lambda": operator})
+        return wrapped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a trie-backed anonymization map.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    build = subcommands.add_parser("build", help="convert a JSON anonymization map into a store directory")
+    build.add_argument("map", help="JSON map ({entity_type: {fake: original}})")
+    build.add_argument("store", help="directory to write the store to")
+    lookup = subcommands.add_parser("lookup", help="look values up in both directions")
+    lookup.add_argument("store")
+    lookup.add_argument("values", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with open(args.map) as map_file:
+            store = MappingStore.build(json.load(map_file))
+        store.save(args.store)
+        size = sum(os.path.getsize(os.path.join(args.store, name)) for name in os.listdir(args.store))
+        print(f"{len(store)} entries, {size / 2**20:.1f} MiB in {args.store}")
+        return
+
+    store = MappingStore.load(args.store)
+    for value in args.values:
+        original = store.original(value)
+        surrogate = store.surrogate(value)
+        if original is None and surrogate is None:
+            print(f"{value}\tnot found", file=sys.stderr)
+        if original is not None:
+            print(f"{value}\t->\t{original}")
+        if surrogate is not None:
+            print(f"{value}\t<-\t{surrogate}")
+
+
+if __name__ == "__main__":
+    main()
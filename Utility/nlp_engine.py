@@ -0,0 +1,222 @@
+import threading
+from collections import OrderedDict
+
+import spacy
+from presidio_analyzer import AnalyzerEngine, RecognizerRegistry
+from presidio_analyzer.nlp_engine import NlpArtifacts, NlpEngine, SpacyNlpEngine
+from presidio_analyzer.predefined_recognizers import SpacyRecognizer
+from presidio_anonymizer.entities import RecognizerResult
+
+# spaCy labels picked up by the custom entity pass in the Utility scripts
+SPACY_ENTITY_LABELS = ("PERSON", "ORG", "GPE")
+
+# Presidio entities that come from the spaCy NER model
+NER_ENTITIES = frozenset(SpacyRecognizer.ENTITIES)
+
+# Model size tiers; "blank" is a tokenizer-only pipeline without NER, for
+# analyzers that rely on the pattern recognizers
+BLANK_MODEL = "blank"
+MODEL_TIERS = {
+    "sm": "en_core_web_sm",
+    "md": "en_core_web_md",
+    "lg": "en_core_web_lg",
+    "blank": BLANK_MODEL,
+}
+
+# Components the NER and the analyzer do not need. In en_core_web_sm/md/lg
+# the shared tok2vec only feeds the tagger and parser (the NER has its own
+# embedding layer), so it goes too. Without the lemmatizer the context-word
+# score boost of the pattern recognizers has no lemmas to match, so a few
+# low-score entities may score lower.
+NER_ONLY_EXCLUDE = ("tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "senter")
+
+# Loaded engines, one per spaCy model, shared by everything in the process
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class SharedNlpEngine(SpacyNlpEngine):
+    """SpacyNlpEngine that can keep the NlpArtifacts of recently processed texts.
+
+    Callers that process a text once and hand the NlpArtifacts to
+    analyzer.analyze and spacy_entity_results() need no cache. For callers
+    that cannot, `cache_size` > 0 keeps that many recent texts, so a second
+    request for the same text is served without running the pipeline again.
+    The cache is off by default: each entry holds a whole spaCy Doc.
+    """
+
+    def __init__(self, model_name="en_core_web_lg", language="en", cache_size=0, exclude=()):
+        super().__init__(models=[{"lang_code": language, "model_name": model_name}])
+        self.exclude = tuple(exclude)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def load(self):
+        """Load the model without the `exclude` components, or a blank pipeline."""
+        model = self.models[0]
+        language, model_name = model["lang_code"], model["model_name"]
+        if model_name == BLANK_MODEL:
+            self.nlp = {language: spacy.blank(language)}
+            return
+        if not self.exclude:
+            super().load()
+            return
+        self._validate_model_params(model)
+        self._download_spacy_model_if_needed(model_name)
+        self.nlp = {language: spacy.load(model_name, exclude=list(self.exclude))}
+
+    def process_text(self, text, language):
+        if self.cache_size <= 0:
+            return super().process_text(text, language)
+
+        key = (language, text)
+        with self._cache_lock:
+            nlp_artifacts = self._cache.get(key)
+            if nlp_artifacts is not None:
+                self._cache.move_to_end(key)
+                return nlp_artifacts
+
+        nlp_artifacts = super().process_text(text, language)
+        self._remember(key, nlp_artifacts)
+        return nlp_artifacts
+
+    def process_stream(self, texts, language, batch_size=32, n_process=1):
+        """Run nlp.pipe over an iterable of texts, yielding (text, NlpArtifacts) in order."""
+        if not self.nlp:
+            raise ValueError("NLP engine is not loaded. Consider calling .load()")
+
+        texts = (str(text) for text in texts)
+        docs = self.nlp[language].pipe(texts, batch_size=batch_size, n_process=n_process)
+        for doc in docs:
+            yield doc.text, self._doc_to_nlp_artifact(doc, language)
+
+    def _remember(self, key, nlp_artifacts):
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = nlp_artifacts
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+
+class NoOpNlpEngine(NlpEngine):
+    """NLP engine that loads and runs no model.
+
+    For analyzers that only need pattern recognizers. The artifacts it
+    returns have no tokens, so Presidio skips the context-word score boost
+    that the spaCy lemmas would otherwise enable.
+    """
+
+    def __init__(self, languages=("en",)):
+        self.languages = list(languages)
+
+    def load(self):
+        pass
+
+    def is_loaded(self):
+        return True
+
+    def process_text(self, text, language):
+        return NlpArtifacts(entities=[], tokens=[], tokens_indices=[], lemmas=[], nlp_engine=None, language=language)
+
+    def process_batch(self, texts, language, **kwargs):
+        for text in texts:
+            yield text, self.process_text(text, language)
+
+    def process_stream(self, texts, language, batch_size=32, n_process=1):
+        return self.process_batch((str(text) for text in texts), language)
+
+    def is_stopword(self, word, language):
+        return False
+
+    def is_punct(self, word, language):
+        return False
+
+    def get_supported_entities(self):
+        return []
+
+    def get_supported_languages(self):
+        return self.languages
+
+
+def needs_ner(entities):
+    """True unless `entities` is a list in which no entity comes from the NER model."""
+    return entities is None or not NER_ENTITIES.isdisjoint(entities)
+
+
+def resolve_model(model_name):
+    """Map a tier (sm/md/lg/blank) to its model name; other names pass through."""
+    return MODEL_TIERS.get(model_name, model_name)
+
+
+def get_nlp_engine(model_name="en_core_web_lg", language="en", ner_only=False):
+    """Return the process-wide engine for `model_name`, loading it on first use.
+
+    `model_name` may be a tier from MODEL_TIERS. With `ner_only`, the
+    components in NER_ONLY_EXCLUDE are not loaded.
+    """
+    model_name = resolve_model(model_name)
+    key = (model_name, language, ner_only)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = SharedNlpEngine(
+                model_name=model_name,
+                language=language,
+                exclude=NER_ONLY_EXCLUDE if ner_only else (),
+            )
+            engine.load()
+            _engines[key] = engine
+    return engine
+
+
+def build_analyzer(nlp_engine=None, recognizers=(), language="en", entities=None):
+    """Create an AnalyzerEngine on top of the shared NLP engine.
+
+    With `entities`, the registry only holds the recognizers for those
+    entities, and when none of them comes from the NER model (and no engine
+    is passed) the analyzer runs on a NoOpNlpEngine: no spaCy model is
+    loaded or run.
+    """
+    if nlp_engine is None:
+        nlp_engine = get_nlp_engine(language=language) if needs_ner(entities) else NoOpNlpEngine([language])
+    if entities is None:
+        analyzer = AnalyzerEngine(nlp_engine=nlp_engine, supported_languages=[language])
+        for recognizer in recognizers:
+            analyzer.registry.add_recognizer(recognizer)
+        return analyzer
+
+    registry = RecognizerRegistry(supported_languages=[language])
+    # Without an NER entity the spaCy recognizer is dropped below anyway
+    registry_engine = nlp_engine if isinstance(nlp_engine, SpacyNlpEngine) else None
+    registry.load_predefined_recognizers(languages=[language], nlp_engine=registry_engine)
+    analyzer = AnalyzerEngine(nlp_engine=nlp_engine, registry=registry, supported_languages=[language])
+
+    # Trim after construction: AnalyzerEngine reloads every predefined
+    # recognizer when it is handed an empty registry
+    wanted = set(entities)
+    registry.recognizers = [
+        recognizer
+        for recognizer in registry.recognizers + list(recognizers)
+        if not wanted.isdisjoint(recognizer.supported_entities)
+    ]
+    return analyzer
+
+
+def spacy_entity_results(nlp_artifacts, labels=SPACY_ENTITY_LABELS, score=0.85):
+    """Turn the raw spaCy entities of an already processed text into results.
+
+    Reads the Doc held by the NlpArtifacts, so the labels are spaCy's own
+    (ORG, GPE, ...) rather than the Presidio names the analyzer maps them to.
+    """
+    return [
+        RecognizerResult(entity_type=ent.label_, start=ent.start_char, end=ent.end_char, score=score)
+        for ent in nlp_artifacts.tokens.ents
+        if ent.label_ in labels
+    ]
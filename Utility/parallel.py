@@ -0,0 +1,210 @@
+import argparse
+import gc
+import itertools
+import multiprocessing
+import os
+import time
+from collections import deque
+
+from presidio_anonymizer import AnonymizerEngine
+
+from Utility.batch import analyze_batch
+from Utility.jsonl_writer import JsonlWriter
+from Utility.nlp_engine import build_analyzer, get_nlp_engine
+from Utility.presets import DEFAULT_ENTITIES, DEFAULT_OPERATORS
+
+# Engines and settings of the running driver. Filled in by the parent before
+# the pool forks, so the workers inherit the loaded model instead of loading it.
+_worker_state = {}
+
+
+def memory_usage():
+    """Return (rss, pss) of the current process in bytes; pss is None if unknown."""
+    rss = pss = None
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            for line in smaps:
+                if line.startswith("Rss:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("Pss:"):
+                    pss = int(line.split()[1]) * 1024
+    except OSError:
+        import resource
+        # Peak rather than current RSS, but the best we have without /proc
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return rss, pss
+
+
+def _anonymize_shard(shard):
+    analyzer = _worker_state["analyzer"]
+    anonymizer = _worker_state["anonymizer"]
+    outputs = []
+    batches = analyze_batch(
+        analyzer,
+        shard,
+        language=_worker_state["language"],
+        entities=_worker_state["entities"],
+        batch_size=len(shard),
+    )
+    for text, results in zip(shard, batches):
+        anonymized = anonymizer.anonymize(text=text, analyzer_results=results, operators=_worker_state["operators"])
+        outputs.append({
+            "anonymized_text": anonymized.text,
+            "anonymized_entities": [item.to_dict() for item in anonymized.items],
+        })
+    # Surrogates written into this shard, and the ones this worker found
+    # standing for two values; the parent merges them into one index
+    index = conflicts = {}
+    pseudonymizer = _worker_state["pseudonymizer"]
+    if pseudonymizer is not None:
+        index = pseudonymizer.take_used()
+        conflicts = pseudonymizer.conflicts
+    rss, pss = memory_usage()
+    return os.getpid(), rss, pss, outputs, index, conflicts
+
+
+def _shards(texts, shard_size):
+    shard = []
+    for text in texts:
+        shard.append(text)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+class ShardedAnonymizer:
+    """Anonymize a corpus on several cores with one model load.
+
+    The analyzer (spaCy model and recognizers) is built and warmed up in the
+    parent; the workers are forked afterwards and share its memory pages
+    copy-on-write. Shards are submitted with a bounded number in flight and the
+    output comes back in input order.
+
+    With a KeyedPseudonymizer, entities are replaced by its keyed surrogates
+    (unless `operators` are given too): every worker derives the same
+    surrogate for the same value from the shared secret, and the surrogates
+    each shard handed out are merged back into `pseudonymizer.index`.
+    Surrogates that stand for two values, in a worker or across workers,
+    end up in `pseudonymizer.conflicts`.
+    """
+
+    def __init__(self, analyzer=None, anonymizer=None, operators=None, entities=None,
+                 language="en", workers=None, max_pending=None, pseudonymizer=None):
+        self.entities = DEFAULT_ENTITIES if entities is None else entities
+        self.analyzer = analyzer or build_analyzer(language=language, entities=self.entities)
+        self.anonymizer = anonymizer or AnonymizerEngine()
+        self.pseudonymizer = pseudonymizer
+        if operators is None:
+            operators = DEFAULT_OPERATORS if pseudonymizer is None else pseudonymizer.operators(self.entities)
+        self.operators = operators
+        self.language = language
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self.stats = {}
+
+    def _warm_up(self):
+        # Lazily loaded recognizers load on first use; do it before forking
+        self.analyzer.analyze(text="warm up", language=self.language, entities=self.entities)
+
+    def run(self, texts, shard_size=64):
+        """Yield one output dict per input text, in input order."""
+        self._warm_up()
+        _worker_state.update(
+            analyzer=self.analyzer,
+            anonymizer=self.anonymizer,
+            operators=self.operators,
+            entities=self.entities,
+            language=self.language,
+            pseudonymizer=self.pseudonymizer,
+        )
+        worker_memory = {}
+        documents = 0
+        started = time.perf_counter()
+
+        # Keep the inherited objects out of the collector so it does not touch
+        # (and copy) their pages in every worker
+        gc.freeze()
+        pool = multiprocessing.get_context("fork").Pool(self.workers)
+        try:
+            pending = deque()
+            for shard in _shards(texts, shard_size):
+                pending.append(pool.apply_async(_anonymize_shard, (shard,)))
+                if len(pending) >= self.max_pending:
+                    documents += yield from self._collect(pending.popleft(), worker_memory)
+            while pending:
+                documents += yield from self._collect(pending.popleft(), worker_memory)
+        finally:
+            pool.terminate()
+            pool.join()
+            gc.unfreeze()
+            _worker_state.clear()
+            elapsed = time.perf_counter() - started
+            self.stats = {
+                "documents": documents,
+                "seconds": elapsed,
+                "docs_per_sec": documents / elapsed if elapsed else 0.0,
+                "conflicts": sum(map(len, self.pseudonymizer.conflicts.values())) if self.pseudonymizer else 0,
+                "workers": {
+                    pid: {"rss_bytes": rss, "pss_bytes": pss}
+                    for pid, (rss, pss) in worker_memory.items()
+                },
+            }
+
+    def _collect(self, async_result, worker_memory):
+        pid, rss, pss, outputs, index, conflicts = async_result.get()
+        worker_memory[pid] = (rss, pss)
+        if index or conflicts:
+            self.pseudonymizer.merge_index(index, conflicts)
+        yield from outputs
+        return len(outputs)
+
+def anonymize_chunks(texts, pseudonymizer, analyzer=None, entities=None, workers=None,
+                     chunk_size=1000, chunk_overlap=100, shard_size=8):
+    """Split documents into chunks first, then anonymize the chunks on several cores.
+
+    Returns (chunks, mapping): the anonymized chunks of every text, in order,
+    and the {entity_type: {surrogate: original}} mapping of every surrogate
+    in the pseudonymizer's index afterwards. Surrogates come from
+    `pseudonymizer`, so the same value gets the same surrogate in every
+    chunk, including the text two chunks overlap on. An entity cut in two by
+    a chunk boundary is seen as two shorter values.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = [chunk for text in texts for chunk in splitter.split_text(text)]
+    driver = ShardedAnonymizer(analyzer=analyzer, entities=entities, workers=workers, pseudonymizer=pseudonymizer)
+    anonymized = [output["anonymized_text"] for output in driver.run(chunks, shard_size=shard_size)]
+    return anonymized, pseudonymizer.deanonymizer_mapping()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Anonymize a file of texts (one per line) on several cores.")
+    parser.add_argument("input", help="text file with one document per line")
+    parser.add_argument("output", help="where to write one JSON line per document (.gz/.zst to compress)")
+    parser.add_argument("--model", default="en_core_web_lg")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard-size", type=int, default=64)
+    parser.add_argument("--ner-only", action="store_true", help="load only the NER components of the model")
+    parser.add_argument("--resume", action="store_true", help="skip the documents already in the output and append")
+    args = parser.parse_args()
+
+    nlp_engine = get_nlp_engine(args.model, ner_only=args.ner_only)
+    driver = ShardedAnonymizer(analyzer=build_analyzer(nlp_engine), workers=args.workers)
+
+    with open(args.input) as input_file, JsonlWriter(args.output, resume=args.resume) as writer:
+        texts = itertools.islice((line.rstrip("\n") for line in input_file), writer.skip, None)
+        writer.write_all(driver.run(texts, shard_size=args.shard_size))
+
+    stats = driver.stats
+    print(f"{stats['documents']} documents in {stats['seconds']:.2f}s ({stats['docs_per_sec']:.1f} docs/sec)")
+    for pid, memory in sorted(stats["workers"].items()):
+        pss = memory["pss_bytes"]
+        print(f"  worker {pid}: rss {memory['rss_bytes'] / 2**20:.0f} MiB"
+              + (f", pss {pss / 2**20:.0f} MiB" if pss is not None else ""))
+
+
+if __name__ == "__main__":
+    main()
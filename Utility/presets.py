@@ -0,0 +1,104 @@
+from presidio_analyzer import Pattern
+from presidio_anonymizer.entities import OperatorConfig
+
+# Entities requested by the Utility scripts
+DEFAULT_ENTITIES = [
+    "PERSON",
+    "PHONE_NUMBER",
+    "EMAIL_ADDRESS",
+    "ORGANIZATION",
+    "LOCATION",
+    "CREDIT_CARD",
+    "DATE_TIME",
+    "NRP",
+    "IP_ADDRESS",
+    "IBAN_CODE",
+    "US_DRIVER_LICENSE",
+    "URL",
+    "AWS_ACCESS_KEY",
+    "IPV4",
+    "IPV6",
+]
+
+# (entity, pattern) pairs of the POLISH_ID/TIME recognizers in main.py
+CUSTOM_PATTERNS = [
+    ("POLISH_ID", Pattern(name="polish_id_pattern", regex="[A-Z]{3}\\d{6}", score=1)),
+    ("TIME", Pattern(name="time_pattern", regex="(1[0-2]|0?[1-9]):[0-5][0-9] (AM|PM)", score=1)),
+]
+CUSTOM_ENTITIES = [entity for entity, _ in CUSTOM_PATTERNS]
+
+# Replace/mask/hash operators from Utility/app.py
+DEFAULT_OPERATORS = {
+    "default": OperatorConfig(
+        operator_name="hash",
+        params={"salt": "mysalt"}  # Use a consistent salt for reversible anonymization
+    ),
+    "PERSON": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{PERSON}"}
+    ),
+    "PHONE_NUMBER": OperatorConfig(
+        operator_name="mask",
+        params={
+            "masking_char": "*",
+            "chars_to_mask": 12,
+            "from_end": True
+        }
+    ),
+    "EMAIL_ADDRESS": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{EMAIL}"}
+    ),
+    "ORGANIZATION": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{ORGANIZATION}"}
+    ),
+    "LOCATION": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{LOCATION}"}
+    ),
+    "CREDIT_CARD": OperatorConfig(
+        operator_name="mask",
+        params={
+            "masking_char": "*",
+            "chars_to_mask": 16,
+            "from_end": True
+        }
+    ),
+    "DATE_TIME": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{DATE}"}
+    ),
+    "NRP": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{NRP}"}
+    ),
+    "IP_ADDRESS": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{IP}"}
+    ),
+    "IBAN_CODE": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{IBAN}"}
+    ),
+    "US_DRIVER_LICENSE": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{DRIVER_LICENSE}"}
+    ),
+    "URL": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{URL}"}
+    ),
+    "AWS_ACCESS_KEY": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{AWS_KEY}"}
+    ),
+    "IPV4": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{IPV4}"}
+    ),
+    "IPV6": OperatorConfig(
+        operator_name="replace",
+        params={"new_value": "{IPV6}"}
+    )
+}
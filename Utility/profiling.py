@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Keys of the non-recognizer steps in stats()
+NLP_STEP = "nlp_engine"
+ANALYZE_STEP = "analyze"
+
+# Marks attributes that were not set on the instance before patching
+_MISSING = object()
+
+
+def _new_entry():
+    return {"calls": 0, "seconds": 0.0, "results": 0, "entities": {}}
+
+
+class RecognizerProfiler:
+    """Opt-in timing of the steps inside AnalyzerEngine.analyze.
+
+    instrument() wraps the analyze method of every recognizer in the
+    registry (and of recognizers added later), the NLP engine's
+    process_text/process_stream and the analyzer's own analyze, by setting
+    instance attributes; nothing changes for analyzers that are not
+    instrumented, and restore() puts the original methods back.
+
+    For each recognizer the profiler records calls, wall time and results,
+    with the results broken down by entity type. A recognizer is called once
+    for all the requested entities it supports, so its time is split evenly
+    between them in the per-entity totals.
+    """
+
+    def __init__(self):
+        self._steps = {}
+        self._names = {}
+        self._patched = []
+        self._lock = threading.Lock()
+        self._logger_thread = None
+        self._logger_stop = threading.Event()
+
+    def _patch(self, owner, attribute, replacement):
+        self._patched.append((owner, attribute, vars(owner).get(attribute, _MISSING)))
+        setattr(owner, attribute, replacement)
+
+    def _record(self, name, seconds, results=(), entities=()):
+        with self._lock:
+            entry = self._steps.setdefault(name, _new_entry())
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["results"] += len(results)
+            share = seconds / len(entities) if entities else 0.0
+            for entity_type in entities:
+                entity = entry["entities"].setdefault(entity_type, {"seconds": 0.0, "results": 0})
+                entity["seconds"] += share
+            for result in results:
+                entity = entry["entities"].setdefault(result.entity_type, {"seconds": 0.0, "results": 0})
+                entity["results"] += 1
+
+    def _step_name(self, recognizer):
+        # Recognizers without an explicit name share their class name
+        name = recognizer.name
+        owner = self._names.setdefault(name, recognizer.id)
+        return name if owner == recognizer.id else recognizer.id
+
+    def instrument_recognizer(self, recognizer):
+        if getattr(recognizer.analyze, "_profiled", False):
+            return recognizer
+        name = self._step_name(recognizer)
+        analyze = recognizer.analyze
+
+        @wraps(analyze)
+        def profiled(text, entities, nlp_artifacts=None, **kwargs):
+            started = time.perf_counter()
+            results = analyze(text, entities, nlp_artifacts, **kwargs)
+            requested = [entity for entity in recognizer.supported_entities if entity in (entities or ())]
+            self._record(name, time.perf_counter() - started, results or (), requested)
+            return results
+
+        profiled._profiled = True
+        self._patch(recognizer, "analyze", profiled)
+        return recognizer
+
+    def instrument_nlp_engine(self, nlp_engine):
+        if getattr(nlp_engine.process_text, "_profiled", False):
+            return nlp_engine
+        process_text = nlp_engine.process_text
+
+        @wraps(process_text)
+        def profiled_text(text, language):
+            started = time.perf_counter()
+            nlp_artifacts = process_text(text, language)
+            self._record(NLP_STEP, time.perf_counter() - started)
+            return nlp_artifacts
+
+        profiled_text._profiled = True
+        self._patch(nlp_engine, "process_text", profiled_text)
+
+        process_stream = getattr(nlp_engine, "process_stream", None)
+        if process_stream is not None:
+            @wraps(process_stream)
+            def profiled_stream(*args, **kwargs):
+                stream = iter(process_stream(*args, **kwargs))
+                while True:
+                    # Time spent producing each item, batching included
+                    started = time.perf_counter()
+                    try:
+                        item = next(stream)
+                    except StopIteration:
+                        return
+                    self._record(NLP_STEP, time.perf_counter() - started)
+                    yield item
+
+            self._patch(nlp_engine, "process_stream", profiled_stream)
+        return nlp_engine
+
+    def instrument(self, analyzer):
+        """Profile `analyzer`, its NLP engine and every recognizer in its registry."""
+        if getattr(analyzer.analyze, "_profiled", False):
+            return analyzer
+        for recognizer in analyzer.registry.recognizers:
+            self.instrument_recognizer(recognizer)
+        self.instrument_nlp_engine(analyzer.nlp_engine)
+
+        registry = analyzer.registry
+        add_recognizer = registry.add_recognizer
+
+        @wraps(add_recognizer)
+        def profiled_add_recognizer(recognizer):
+            add_recognizer(recognizer)
+            self.instrument_recognizer(recognizer)
+
+        self._patch(registry, "add_recognizer", profiled_add_recognizer)
+
+        analyze = analyzer.analyze
+
+        @wraps(analyze)
+        def profiled_analyze(*args, **kwargs):
+            started = time.perf_counter()
+            results = analyze(*args, **kwargs)
+            self._record(ANALYZE_STEP, time.perf_counter() - started, results)
+            return results
+
+        profiled_analyze._profiled = True
+        self._patch(analyzer, "analyze", profiled_analyze)
+        return analyzer
+
+    def restore(self):
+        """Remove every wrapper installed by this profiler."""
+        while self._patched:
+            owner, attribute, previous = self._patched.pop()
+            if previous is _MISSING:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, previous)
+
+    def stats(self):
+        """Return a copy of the totals: {step: {calls, seconds, results, entities}}."""
+        with self._lock:
+            return {
+                name: {
+                    **entry,
+                    "entities": {entity: dict(totals) for entity, totals in entry["entities"].items()},
+                }
+                for name, entry in self._steps.items()
+            }
+
+    def entity_stats(self):
+        """Totals per entity type across recognizers: {entity: {seconds, results}}."""
+        totals = {}
+        for name, entry in self.stats().items():
+            if name in (NLP_STEP, ANALYZE_STEP):
+                continue
+            for entity_type, entity in entry["entities"].items():
+                total = totals.setdefault(entity_type, {"seconds": 0.0, "results": 0})
+                total["seconds"] += entity["seconds"]
+                total["results"] += entity["results"]
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._steps.clear()
+
+    def report(self, top=None):
+        """Return a text table of the steps, most expensive first."""
+        stats = self.stats()
+        total = stats.get(ANALYZE_STEP, {}).get("seconds") or sum(entry["seconds"] for entry in stats.values())
+        rows = sorted(stats.items(), key=lambda item: item[1]["seconds"], reverse=True)
+        lines = [f"{'step':<40} {'calls':>8} {'total s':>9} {'share':>6} {'ms/call':>8} {'results':>8}"]
+        for name, entry in rows[:top]:
+            share = entry["seconds"] / total if total else 0.0
+            per_call = 1000 * entry["seconds"] / entry["calls"] if entry["calls"] else 0.0
+            lines.append(
+                f"{name[:40]:<40} {entry['calls']:>8} {entry['seconds']:>9.3f} {share:>6.1%} "
+                f"{per_call:>8.3f} {entry['results']:>8}"
+            )
+        return "\n".join(lines)
+
+    def start_logging(self, interval=60.0, top=None, log=None):
+        """Log report() every `interval` seconds from a daemon thread."""
+        log = log or logger
+        self.stop_logging()
+        self._logger_stop.clear()
+
+        def dump():
+            while not self._logger_stop.wait(interval):
+                log.info("Recognizer profile:\n%s", self.report(top=top))
+
+        self._logger_thread = threading.Thread(target=dump, name="recognizer-profiler", daemon=True)
+        self._logger_thread.start()
+
+    def stop_logging(self):
+        if self._logger_thread is not None:
+            self._logger_stop.set()
+            self._logger_thread.join()
+            self._logger_thread = None
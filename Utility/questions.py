@@ -0,0 +1,69 @@
+import asyncio
+import json
+import threading
+import time
+from functools import wraps
+
+
+def load_questions(path):
+    """Read questions from a JSON list or a text file with one question per line."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return [str(question) for question in json.load(f)]
+        return [line.strip() for line in f if line.strip()]
+
+
+def serialized(func, lock=None):
+    """Wrap `func` so that concurrent callers run it one at a time.
+
+    PresidioReversibleAnonymizer.anonymize updates its mapping and Faker
+    state, so it must not run on two questions at once; the retrieval and
+    LLM calls around it still overlap. The wrapper exposes its `lock`, for
+    readers of the same mapping (Deanonymizer.from_anonymizer), and `calls`,
+    the number of completed calls, which only changes under the lock.
+    """
+    lock = threading.Lock() if lock is None else lock
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with lock:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                wrapper.calls += 1
+
+    wrapper.lock = lock
+    wrapper.calls = 0
+    return wrapper
+
+
+async def aanswer_questions(chain, questions, max_concurrency=8):
+    """Run every question through `chain`, at most `max_concurrency` at a time.
+
+    Returns one dict per question, in input order, with the answer (or the
+    error) and the time the question took.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def answer(question):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = {"question": question, "answer": await chain.ainvoke(question)}
+            except Exception as error:
+                result = {"question": question, "answer": None, "error": repr(error)}
+            result["seconds"] = time.perf_counter() - started
+            return result
+
+    return await asyncio.gather(*(answer(question) for question in questions))
+
+
+def answer_questions(chain, questions, max_concurrency=8):
+    """Blocking wrapper around aanswer_questions for the scripts."""
+    return asyncio.run(aanswer_questions(chain, questions, max_concurrency=max_concurrency))
+
+
+def print_answers(answers):
+    for answer in answers:
+        print(f"[{answer['seconds']:.1f}s] {answer['question']}")
+        print(answer["answer"] if "error" not in answer else f"Error: {answer['error']}")
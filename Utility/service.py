@@ -0,0 +1,394 @@
+import argparse
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import orjson
+from presidio_anonymizer import AnonymizerEngine
+
+from Utility.batch import analyze_batch
+from Utility.combined_recognizer import CombinedPatternRecognizer
+from Utility.config import ConfigError, ReloadableConfig
+from Utility.deanonymizer import LookupDeanonymizer
+from Utility.keyed_pseudonymizer import KeyedPseudonymizer
+from Utility.nlp_engine import build_analyzer, get_nlp_engine, needs_ner
+from Utility.presets import CUSTOM_ENTITIES, CUSTOM_PATTERNS, DEFAULT_ENTITIES, DEFAULT_OPERATORS
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the queue for the batching thread
+_STOP = object()
+
+
+class MicroBatcher:
+    """Group analyze calls from many threads into batches for analyze_batch.
+
+    A single thread takes the first waiting request, then keeps collecting
+    until it has `max_batch_size` of them or `max_wait_ms` have passed, and
+    runs them through spaCy's nlp.pipe together. Requests asking for
+    different entities or languages in the same batch are analyzed in one
+    group each. Callers get a Future, or block in analyze().
+
+    With a ReloadableConfig as `config`, a request submitted with a
+    `snapshot` of it is analyzed with that snapshot pinned, even if the
+    config was reloaded while it waited.
+    """
+
+    def __init__(self, analyzer, max_batch_size=64, max_wait_ms=5.0, language="en", config=None):
+        self.analyzer = analyzer
+        self.config = config
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.language = language
+        self.batches = 0
+        self.requests = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text, entities=None, language=None, snapshot=None):
+        future = Future()
+        entities = None if entities is None else tuple(entities)
+        self._queue.put((text, entities, language or self.language, snapshot, future))
+        return future
+
+    def analyze(self, text, entities=None, language=None, timeout=None, snapshot=None):
+        return self.submit(text, entities, language, snapshot).result(timeout)
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Finish this batch, then stop
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[2], item[1], item[3]), []).append(item)
+            for (language, entities, snapshot), items in groups.items():
+                futures = [future for _, _, _, _, future in items]
+                pinned = nullcontext()
+                if self.config is not None and snapshot is not None:
+                    pinned = self.config.use(snapshot)
+                try:
+                    # analyze_batch is lazy; the results are made inside the block
+                    with pinned:
+                        results = analyze_batch(
+                            self.analyzer,
+                            [text for text, _, _, _, _ in items],
+                            language=language,
+                            entities=None if entities is None else list(entities),
+                            batch_size=len(items),
+                        )
+                        for future, result in zip(futures, results):
+                            future.set_result(result)
+                except Exception as error:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(error)
+            self.batches += 1
+            self.requests += len(batch)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+        }
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+
+class AnonymizationService:
+    """The engines behind the HTTP endpoints, loaded once and kept warm.
+
+    Analysis goes through a MicroBatcher. With a KeyedPseudonymizer, entities
+    are replaced by keyed surrogates, which /deanonymize restores from the
+    pseudonymizer's index; otherwise the preset operators (replace/mask/hash)
+    are used and cannot be reversed. A deanonymizer `mapping` or a
+    MappingStore `store` restores surrogates from earlier runs too.
+
+    /deanonymize finds surrogates with a LookupDeanonymizer, which takes in
+    each new surrogate in O(1) and keeps only its hash; the originals are
+    decrypted from the index when a surrogate is found, so the service holds
+    no copy of the mapping of its own.
+
+    With a ReloadableConfig, its entities are requested and its operators
+    override the others. Each request reads the current snapshot once and
+    is analyzed and anonymized with it, through the batcher's `config`;
+    reload() swaps in a new one for later requests without stopping the
+    service.
+    """
+
+    def __init__(self, batcher, entities=None, operators=None, pseudonymizer=None, mapping=None, store=None,
+                 config=None):
+        self.batcher = batcher
+        self.entities = entities
+        self.anonymizer = AnonymizerEngine()
+        self.pseudonymizer = pseudonymizer
+        if operators is None:
+            operators = DEFAULT_OPERATORS if pseudonymizer is None else pseudonymizer.operators(entities)
+        self.operators = operators
+        self.store = store
+        self.config = config
+        # Surrogate -> original of the given mapping, which does not change
+        self._mapping = {
+            surrogate: original
+            for values in (mapping or {}).values()
+            for surrogate, original in values.items()
+        }
+        known = list(self._mapping)
+        if pseudonymizer is not None:
+            known += [surrogate for tokens in pseudonymizer.index.values() for surrogate in tokens]
+        self._deanonymizer = LookupDeanonymizer(self._reveal, known)
+
+    def _settings(self, request):
+        # One snapshot per request, so its entities and operators match
+        snapshot = self.config.snapshot if self.config is not None else None
+        entities = request.get("entities")
+        if entities is None and self.entities is not None:
+            entities = self.entities
+            if snapshot is not None:
+                entities = entities + [entity for entity in snapshot.entities if entity not in entities]
+        operators = self.operators if snapshot is None else {**self.operators, **snapshot.operators}
+        return entities, operators, snapshot
+
+    def analyze(self, request):
+        entities, _, snapshot = self._settings(request)
+        language = request.get("language")
+        if "texts" in request:
+            futures = [self.batcher.submit(text, entities, language, snapshot) for text in request["texts"]]
+            return {"results": [[result.to_dict() for result in future.result()] for future in futures]}
+        results = self.batcher.analyze(request["text"], entities, language, snapshot=snapshot)
+        return {"results": [result.to_dict() for result in results]}
+
+    def _reveal(self, surrogate):
+        original = self._mapping.get(surrogate)
+        if original is None and self.pseudonymizer is not None:
+            index = self.pseudonymizer.index
+            for entity_type in tuple(index):
+                original = self.pseudonymizer.reveal(entity_type, surrogate)
+                if original is not None:
+                    break
+        return original
+
+    def _remember(self, items):
+        # Make the surrogates handed out findable by /deanonymize
+        index = self.pseudonymizer.index
+        for item in items:
+            if item.text in index.get(item.entity_type, ()):
+                self._deanonymizer.add(item.text)
+        # The delta kept for merging shards is not needed here; drop it so it
+        # does not grow for as long as the service runs
+        self.pseudonymizer.take_used()
+
+    def _anonymize_one(self, text, future, operators):
+        anonymized = self.anonymizer.anonymize(text=text, analyzer_results=future.result(), operators=operators)
+        if self.pseudonymizer is not None:
+            self._remember(anonymized.items)
+        return {"text": anonymized.text, "items": [item.to_dict() for item in anonymized.items]}
+
+    def anonymize(self, request):
+        entities, operators, snapshot = self._settings(request)
+        language = request.get("language")
+        if "texts" in request:
+            texts = request["texts"]
+            futures = [self.batcher.submit(text, entities, language, snapshot) for text in texts]
+            return {"results": [self._anonymize_one(text, future, operators) for text, future in zip(texts, futures)]}
+        return self._anonymize_one(
+            request["text"], self.batcher.submit(request["text"], entities, language, snapshot), operators
+        )
+
+    def deanonymize(self, request):
+        def restore(text):
+            if self.store is not None:
+                text = self.store.deanonymize(text)
+            return self._deanonymizer.deanonymize(text)
+
+        if "texts" in request:
+            return {"texts": [restore(text) for text in request["texts"]]}
+        return {"text": restore(request["text"])}
+
+    def reload(self):
+        """Reload the recognizer configuration; raises ConfigError and keeps the old one if it is invalid."""
+        if self.config is None:
+            raise ConfigError("the service was started without --config")
+        snapshot = self.config.reload()
+        return {"revision": snapshot.revision, "entities": snapshot.entities}
+
+    def stats(self):
+        stats = {"batcher": self.batcher.stats(), "mapping_entries": len(self._deanonymizer)}
+        if self.config is not None:
+            stats["config_revision"] = self.config.snapshot.revision
+        return stats
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP: POST /analyze, /anonymize, /deanonymize and /reload, GET /health."""
+
+    service = None
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body):
+        payload = orjson.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(HTTPStatus.OK, {"status": "ok", **self.service.stats()})
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path == "/reload":
+            try:
+                self._send(HTTPStatus.OK, self.service.reload())
+            except (ConfigError, OSError) as error:
+                self._send(HTTPStatus.BAD_REQUEST, {"error": str(error)})
+            return
+        endpoint = {
+            "/analyze": self.service.analyze,
+            "/anonymize": self.service.anonymize,
+            "/deanonymize": self.service.deanonymize,
+        }.get(self.path)
+        if endpoint is None:
+            self._send(HTTPStatus.NOT_FOUND, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            request = orjson.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if not isinstance(request, dict) or ("text" not in request and "texts" not in request):
+                raise ValueError('expected a JSON object with "text" or "texts"')
+        except ValueError as error:
+            self._send(HTTPStatus.BAD_REQUEST, {"error": str(error)})
+            return
+        try:
+            self._send(HTTPStatus.OK, endpoint(request))
+        except Exception as error:
+            logger.exception("%s failed", self.path)
+            self._send(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(error)})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many clients connect at once; the default listen backlog of 5 resets them
+    request_queue_size = 1024
+
+
+def serve(service, host="127.0.0.1", port=8000):
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"service": service})
+    return ServiceServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve analysis, anonymization and deanonymization over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", default=os.getenv("SPACY_MODEL", "lg"), help="model name or tier (sm, md, lg, blank)")
+    parser.add_argument("--ner-only", action="store_true", help="load only the NER components of the model")
+    parser.add_argument("--entities", nargs="*", help="entities to request (default: the presets and the custom ones)")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="how long a batch waits to fill up")
+    parser.add_argument("--map", help="anonymization map (JSON file or mapping store directory) for /deanonymize")
+    parser.add_argument("--index", help="keyed surrogate index to load at start and save at shutdown, "
+                                        "so /deanonymize keeps working across restarts")
+    parser.add_argument("--config", default=os.getenv("RECOGNIZER_CONFIG"),
+                        help="recognizer and operator config (YAML/JSON), reloadable; replaces the custom patterns")
+    parser.add_argument("--watch", type=float, help="reload --config when it changes, checking every N seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # Keyed surrogates make /anonymize reversible; the secret is the key
+    secret = os.getenv("PSEUDONYM_SECRET")
+    pseudonymizer = KeyedPseudonymizer(secret) if secret else None
+    if args.index and not pseudonymizer:
+        parser.error("--index needs PSEUDONYM_SECRET")
+    if args.index and os.path.exists(args.index):
+        pseudonymizer.load_index(args.index)
+
+    config = None
+    if args.config:
+        config = ReloadableConfig(args.config, pseudonymizer=pseudonymizer)
+        recognizer = config.recognizer()
+        entities = args.entities or DEFAULT_ENTITIES + config.entities
+    else:
+        recognizer = CombinedPatternRecognizer(patterns=CUSTOM_PATTERNS)
+        entities = args.entities or DEFAULT_ENTITIES + CUSTOM_ENTITIES
+
+    nlp_engine = get_nlp_engine(args.model, ner_only=args.ner_only) if needs_ner(entities) else None
+    analyzer = build_analyzer(nlp_engine, recognizers=[recognizer], entities=entities)
+    # Lazily loaded recognizers load on first use; not on the first request
+    analyzer.analyze(text="warm up", language="en", entities=entities)
+
+    mapping = store = None
+    if args.map and os.path.isdir(args.map):
+        from Utility.mapping_store import MappingStore
+
+        store = MappingStore.load(args.map)
+    elif args.map:
+        with open(args.map, "rb") as map_file:
+            mapping = orjson.loads(map_file.read())
+
+    batcher = MicroBatcher(analyzer, args.max_batch_size, args.max_wait_ms, config=config)
+    service = AnonymizationService(
+        batcher, entities, pseudonymizer=pseudonymizer, mapping=mapping, store=store, config=config
+    )
+    server = serve(service, args.host, args.port)
+
+    if config is not None:
+        def reload_config(*_):
+            try:
+                config.reload()
+            except (ConfigError, OSError) as error:
+                logger.error("Keeping revision %s: %s", config.snapshot.revision, error)
+
+        # Compile off the serving thread; the swap itself is one assignment
+        signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=reload_config, daemon=True).start())
+        if args.watch:
+            config.watch(args.watch)
+    logger.info("Serving on http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if args.index:
+            pseudonymizer.save_index(args.index)
+
+
+if __name__ == "__main__":
+    main()
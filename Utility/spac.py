@@ -1,16 +1,35 @@
-import json
-import spacy
-from presidio_analyzer import AnalyzerEngine, PatternRecognizer, Pattern
+import os
+from presidio_analyzer import PatternRecognizer, Pattern
 from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.entities import OperatorConfig, RecognizerResult
-from faker import Faker
-from langchain_experimental.data_anonymizer import PresidioReversibleAnonymizer
-
-# Initialize Faker
-fake = Faker()
+from Utility.jsonl_writer import save_output
+from Utility.nlp_engine import build_analyzer, get_nlp_engine, spacy_entity_results
+from Utility.substitution import substitute_spans
+from Utility.surrogate_pool import SurrogatePools
+
+# Faker providers used to generate fake data for each entity type
+fake_generators = {
+    "default": lambda fake: fake.text(),
+    "PERSON": lambda fake: fake.name(),
+    "PHONE_NUMBER": lambda fake: fake.phone_number(),
+    "EMAIL_ADDRESS": lambda fake: fake.email(),
+    "ORGANIZATION": lambda fake: fake.company(),
+    "LOCATION": lambda fake: fake.address(),
+    "CREDIT_CARD": lambda fake: fake.credit_card_number(),
+    "DATE_TIME": lambda fake: fake.date_time().isoformat(),
+    "NRP": lambda fake: fake.ssn(),
+    "IP_ADDRESS": lambda fake: fake.ipv4(),
+    "IBAN_CODE": lambda fake: fake.iban(),
+    "US_DRIVER_LICENSE": lambda fake: fake.license_plate(),
+    "URL": lambda fake: fake.url(),
+    "AWS_ACCESS_KEY": lambda fake: fake.uuid4(),
+    "IPV4": lambda fake: fake.ipv4(),
+    "IPV6": lambda fake: fake.ipv6(),
+    "LEGAL_TERM": lambda fake: fake.bs()
+}
 
-# Initialize SpaCy
-nlp = spacy.load("en_core_web_lg")
+# Generate unique fake values per entity type in the background while the model loads
+surrogate_pools = SurrogatePools(fake_generators)
+surrogate_pools.prefill()
 
 # Define custom patterns for legal terms
 legal_patterns = [
@@ -22,29 +41,24 @@ legal_patterns = [
 # Create custom recognizers for legal terms
 legal_recognizers = [PatternRecognizer(supported_entity="LEGAL_TERM", patterns=[pattern]) for pattern in legal_patterns]
 
-# Initialize the Presidio analyzer and add the custom recognizers
-analyzer = AnalyzerEngine()
-for recognizer in legal_recognizers:
-    analyzer.registry.add_recognizer(recognizer)
+# Load only the NER part of the spaCy model; SPACY_MODEL picks the tier (sm, md, lg or blank)
+nlp_engine = get_nlp_engine(os.getenv("SPACY_MODEL", "lg"), ner_only=True)
+
+# Initialize the Presidio analyzer on the shared spaCy engine and add the custom recognizers
+analyzer = build_analyzer(nlp_engine, recognizers=legal_recognizers)
 
 # Initialize the Presidio anonymizer
 anonymizer_engine = AnonymizerEngine()
 
-# Initialize the PresidioReversibleAnonymizer from langchain_experimental
-anonymizer = PresidioReversibleAnonymizer(
-    add_default_faker_operators=False,
-)
-
 # Sample text containing legal terms
 text = ("My name is John Doe, I am from Microsoft. As per our Confidentiality Agreement, "
         "I cannot disclose the Bank Account Number: 1234567890 of our client.")
 
-# Analyze the text using SpaCy to identify entities
-doc = nlp(text)
-spacy_results = []
-for ent in doc.ents:
-    if ent.label_ in ["PERSON", "ORG", "GPE"]:
-        spacy_results.append(RecognizerResult(entity_type=ent.label_, start=ent.start_char, end=ent.end_char, score=0.85))
+# Run the spaCy pipeline once; its output feeds both passes below
+nlp_artifacts = analyzer.nlp_engine.process_text(text, "en")
+
+# Pick the PERSON, ORG and GPE entities out of the spaCy output
+spacy_results = spacy_entity_results(nlp_artifacts)
 
 # Analyze the text using Presidio to identify PII entities including the custom legal terms
 presidio_results = analyzer.analyze(
@@ -67,7 +81,8 @@ presidio_results = analyzer.analyze(
         "IPV6",
         "LEGAL_TERM"
     ], 
-    language="en"
+    language="en",
+    nlp_artifacts=nlp_artifacts
 )
 
 # Combine the results from SpaCy and Presidio
@@ -76,81 +91,12 @@ results = presidio_results + spacy_results
 # Create a mapping for PII to fake data
 pii_to_fake = {}
 
-# Configure the anonymizer to use Faker for generating fake data
-anonymizer_config = {
-    "default": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.text()}
-    ),
-    "PERSON": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.name()}
-    ),
-    "PHONE_NUMBER": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.phone_number()}
-    ),
-    "EMAIL_ADDRESS": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.email()}
-    ),
-    "ORGANIZATION": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.company()}
-    ),
-    "LOCATION": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.address()}
-    ),
-    "CREDIT_CARD": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.credit_card_number()}
-    ),
-    "DATE_TIME": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.date_time().isoformat()}
-    ),
-    "NRP": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.ssn()}
-    ),
-    "IP_ADDRESS": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.ipv4()}
-    ),
-    "IBAN_CODE": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.iban()}
-    ),
-    "US_DRIVER_LICENSE": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.license_plate()}
-    ),
-    "URL": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.url()}
-    ),
-    "AWS_ACCESS_KEY": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.uuid4()}
-    ),
-    "IPV4": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.ipv4()}
-    ),
-    "IPV6": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.ipv6()}
-    ),
-    "LEGAL_TERM": OperatorConfig(
-        operator_name="custom",
-        params={"function": lambda x: fake.bs()}
-    )
-}
+# Configure the anonymizer to draw fake data from the pools
+anonymizer_config = surrogate_pools.operators(fake_generators, param="function")
 
 # Function to generate fake data and keep the mapping
 def custom_anonymize(entity_text, entity_type):
-    if entity_type not in pii_to_fake:
+    if entity_text not in pii_to_fake:
         if entity_type in anonymizer_config:
             fake_data = anonymizer_config[entity_type].params['function'](entity_text)
             pii_to_fake[entity_text] = fake_data
@@ -159,15 +105,8 @@ def custom_anonymize(entity_text, entity_type):
             pii_to_fake[entity_text] = fake_data
     return pii_to_fake[entity_text]
 
-# Perform the anonymization using PresidioReversibleAnonymizer
-anonymized_text = anonymizer.anonymize(text)
-
-# Update the anonymized text with fake data
-for entity in results:
-    original_text = text[entity.start:entity.end]
-    anonymized_version = custom_anonymize(original_text, entity.entity_type)
-    # Replace the original text with the anonymized version
-    anonymized_text = anonymized_text.replace(original_text, anonymized_version, 1)
+# Replace every entity with its fake data in a single pass over the text
+anonymized_text, substituted = substitute_spans(text, results, custom_anonymize)
 
 # Prepare the JSON output
 output = {
@@ -175,18 +114,20 @@ output = {
     "anonymized_text": anonymized_text,
     "anonymized_entities": [
         {
-            "entity_type": entity.entity_type,
-            "start": entity.start,
-            "end": entity.end,
-            "text": text[entity.start:entity.end],
-            "anonymized_text": custom_anonymize(text[entity.start:entity.end], entity.entity_type)
-        } for entity in results
+            "entity_type": span.entity.entity_type,
+            "start": span.start,
+            "end": span.end,
+            "text": span.text,
+            "anonymized_start": span.new_start,
+            "anonymized_end": span.new_end,
+            "anonymized_text": span.new_text
+        } for span in substituted
     ]
 }
 
-# Save the output to a JSON file
-with open("anonymized_data.json", "w") as json_file:
-    json.dump(output, json_file, indent=4)
+# Save the output to a JSON file; with ANONYMIZED_OUTPUT set to a
+# .jsonl(.gz/.zst) path, append it as one compact record instead
+save_output(output, os.getenv("ANONYMIZED_OUTPUT", "anonymized_data.json"))
 
 # Print the results
 print("Original Text:", text)
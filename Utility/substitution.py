@@ -0,0 +1,57 @@
+from collections import namedtuple
+
+# One replaced span: the recognizer result it came from, its offsets in the
+# original text, the replacement value and its offsets in the new text
+SubstitutedSpan = namedtuple(
+    "SubstitutedSpan",
+    ["entity", "start", "end", "text", "new_start", "new_end", "new_text"],
+)
+
+
+def resolve_overlaps(results):
+    """Return the results sorted by start with overlapping spans dropped.
+
+    The leftmost span wins; spans starting at the same offset are ranked by
+    score and then by length, so duplicate hits from two recognizers
+    (e.g. Presidio and the spaCy pass both finding a PERSON) collapse into one.
+    """
+    ordered = sorted(results, key=lambda r: (r.start, -r.score, -(r.end - r.start)))
+    kept = []
+    last_end = -1
+    for result in ordered:
+        if result.start >= last_end and result.end > result.start:
+            kept.append(result)
+            last_end = result.end
+    return kept
+
+
+def substitute_spans(text, results, replacement):
+    """Replace every span in `results` in a single left-to-right pass.
+
+    `replacement(original_text, entity_type)` returns the value to put in
+    place of a span. Returns the new text and a list of SubstitutedSpan with
+    the offsets of every replacement in both the original and the new text.
+    """
+    pieces = []
+    spans = []
+    cursor = 0
+    shift = 0
+    for result in resolve_overlaps(results):
+        original = text[result.start:result.end]
+        new_value = replacement(original, result.entity_type)
+        pieces.append(text[cursor:result.start])
+        pieces.append(new_value)
+        new_start = result.start + shift
+        spans.append(SubstitutedSpan(
+            entity=result,
+            start=result.start,
+            end=result.end,
+            text=original,
+            new_start=new_start,
+            new_end=new_start + len(new_value),
+            new_text=new_value,
+        ))
+        shift += len(new_value) - (result.end - result.start)
+        cursor = result.end
+    pieces.append(text[cursor:])
+    return "".join(pieces), spans
@@ -0,0 +1,65 @@
+import re
+
+# Faker provider per entity type, following Utility/fake.py and main.py.
+# Each generator takes a Faker instance and returns one surrogate value.
+FAKER_GENERATORS = {
+    "PERSON": lambda fake: fake.name(),
+    "PHONE_NUMBER": lambda fake: fake.phone_number(),
+    "EMAIL_ADDRESS": lambda fake: fake.email(),
+    "ORGANIZATION": lambda fake: fake.company(),
+    "LOCATION": lambda fake: fake.city(),
+    "CREDIT_CARD": lambda fake: fake.credit_card_number(),
+    "DATE_TIME": lambda fake: fake.date(),
+    "NRP": lambda fake: fake.ssn(),
+    "IP_ADDRESS": lambda fake: fake.ipv4(),
+    "IBAN_CODE": lambda fake: fake.iban(),
+    "US_DRIVER_LICENSE": lambda fake: fake.license_plate(),
+    "US_SSN": lambda fake: fake.ssn(),
+    "US_BANK_NUMBER": lambda fake: fake.bban(),
+    "US_PASSPORT": lambda fake: fake.bothify(text="?########").upper(),
+    "URL": lambda fake: fake.url(),
+    "AWS_ACCESS_KEY": lambda fake: fake.uuid4(),
+    "IPV4": lambda fake: fake.ipv4(),
+    "IPV6": lambda fake: fake.ipv6(),
+    "LEGAL_TERM": lambda fake: fake.bs(),
+    "POLISH_ID": lambda fake: fake.bothify(text="???######").upper(),
+    "TIME": lambda fake: fake.time(pattern="%I:%M %p"),
+}
+FALLBACK_GENERATOR = lambda fake: fake.bothify(text="????-########").upper()  # noqa: E731
+
+# Same shapes drawn from larger value spaces, for keyed surrogates: those
+# are seeded by the value and cannot draw again, so two values only get
+# different surrogates if the space is large enough for them not to meet.
+WIDE_GENERATORS = {
+    **FAKER_GENERATORS,
+    "PERSON": lambda fake: f"{fake.first_name()} {fake.random_uppercase_letter()}. {fake.last_name()}",
+    "EMAIL_ADDRESS": lambda fake: f"{fake.user_name()}{fake.random_int(10, 9999)}@{fake.free_email_domain()}",
+    "ORGANIZATION": lambda fake: f"{fake.last_name()} {fake.word().title()} {fake.company_suffix()}",
+    "LOCATION": lambda fake: f"{fake.city()}, {fake.state_abbr()} {fake.zipcode()}",
+    "DATE_TIME": lambda fake: fake.date_time().isoformat(),
+    "URL": lambda fake: f"https://{fake.domain_name()}/{fake.uri_path()}/{fake.random_int(1, 9999)}",
+    "LEGAL_TERM": lambda fake: f"{fake.bs().title()} Clause {fake.random_int(1, 99)}",
+}
+
+
+# Times as the TIME recognizer finds them, e.g. "9:05 PM"
+_TIME = re.compile(r"\s*(\d{1,2}):([0-5]\d)\s*([AaPp])\.?\s*[Mm]\.?\s*")
+
+
+def _canonical_time(value):
+    match = _TIME.fullmatch(value)
+    if match is None or not 1 <= int(match.group(1)) <= 12:
+        return None
+    return f"{int(match.group(1)):02d}:{match.group(2)} {match.group(3).upper()}M"
+
+
+# Entity types whose surrogates can all be listed, as (values, canonical),
+# where canonical(value) returns the form of an original in `values` or
+# None. Keyed surrogates of such values come from a keyed permutation of
+# the list, so two of them never share a surrogate however small the space.
+ENUMERATED_SPACES = {
+    "TIME": (
+        [f"{hour:02d}:{minute:02d} {half}" for half in ("AM", "PM") for hour in range(1, 13) for minute in range(60)],
+        _canonical_time,
+    ),
+}
@@ -0,0 +1,251 @@
+import logging
+import queue
+import threading
+from collections import deque
+
+from faker import Faker
+from presidio_anonymizer.entities import OperatorConfig
+
+from Utility.surrogate_generators import FALLBACK_GENERATOR, FAKER_GENERATORS
+
+logger = logging.getLogger(__name__)
+
+
+class SurrogatePoolExhausted(Exception):
+    """Raised when a generator cannot produce any more unique values."""
+
+
+class SurrogatePool:
+    """Unique fake values for one entity type, generated in batches.
+
+    Values are produced `batch_size` at a time and handed out from a deque,
+    so take() is O(1). Every value ever generated is remembered, so a value
+    is never handed out twice. When fewer than `low_watermark` values are
+    left, `on_low` is called so the owner can refill the pool off the hot
+    path; an empty pool is refilled synchronously.
+
+    A generator is considered exhausted after `max_misses` duplicates in a
+    row, which happens for small value spaces such as TIME ("%I:%M %p" has
+    1440 values).
+    """
+
+    def __init__(self, generator, faker, faker_lock=None, batch_size=512, low_watermark=None,
+                 max_misses=1000, on_low=None, name=None):
+        self.generator = generator
+        self.faker = faker
+        self.batch_size = batch_size
+        self.low_watermark = batch_size // 4 if low_watermark is None else low_watermark
+        self.max_misses = max_misses
+        self.on_low = on_low
+        self.name = name
+        self.exhausted = False
+        self.issued = set()
+        self._ready = deque()
+        self._faker_lock = faker_lock or threading.Lock()
+        self._fill_lock = threading.Lock()
+        self._refill_requested = False
+
+    def __len__(self):
+        return len(self._ready)
+
+    def fill(self, count=None):
+        """Generate up to `count` new unique values; return how many were added."""
+        count = self.batch_size if count is None else count
+        with self._fill_lock:
+            self._refill_requested = False
+            added = 0
+            misses = 0
+            while added < count and not self.exhausted:
+                # The Faker instance is shared between pools and not thread-safe
+                with self._faker_lock:
+                    value = str(self.generator(self.faker))
+                if value in self.issued:
+                    misses += 1
+                    if misses >= self.max_misses:
+                        self.exhausted = True
+                    continue
+                misses = 0
+                self.issued.add(value)
+                self._ready.append(value)
+                added += 1
+            return added
+
+    def reserve(self, values):
+        """Mark values handed out elsewhere (e.g. in a stored map) as issued."""
+        with self._fill_lock:
+            values = set(values) - self.issued
+            self.issued |= values
+            if values and any(value in values for value in self._ready):
+                self._ready = deque(value for value in self._ready if value not in values)
+
+    def take(self):
+        """Return a value no earlier take() returned."""
+        try:
+            value = self._ready.popleft()
+        except IndexError:
+            self.fill()
+            try:
+                value = self._ready.popleft()
+            except IndexError:
+                raise SurrogatePoolExhausted(
+                    f"No unique values left for {self.name or 'this pool'} "
+                    f"after {len(self.issued)} were issued"
+                ) from None
+
+        if (self.on_low is not None and not self._refill_requested and not self.exhausted
+                and len(self._ready) < self.low_watermark):
+            self._refill_requested = True
+            self.on_low(self)
+        return value
+
+
+class SurrogatePools:
+    """One SurrogatePool per entity type, refilled by a background thread.
+
+    `generators` maps entity types to functions taking a Faker instance (see
+    Utility/surrogate_generators.py); types without a generator use the
+    "default" entry, or FALLBACK_GENERATOR. Pools are created on first use;
+    prefill() queues them for generation ahead of time, e.g. while the spaCy
+    model loads.
+
+    take() with the original value hands the same surrogate out again for a
+    repeated original, and reserve() loads a stored map, so its surrogates
+    are not handed out for other values and its originals keep theirs. Once
+    a pool is exhausted, further values come from an overflow pool of
+    FALLBACK_GENERATOR values instead of failing the anonymize call.
+    """
+
+    def __init__(self, generators=None, locale="en_US", seed=None, batch_size=512,
+                 low_watermark=None, max_misses=1000):
+        self.generators = dict(FAKER_GENERATORS if generators is None else generators)
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.max_misses = max_misses
+        self.faker = Faker(locale)
+        if seed is not None:
+            self.faker.seed_instance(seed)
+        self._faker_lock = threading.Lock()
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._worker = None
+        # (entity_type, original) -> surrogate
+        self._assigned = {}
+        self._assigned_lock = threading.Lock()
+        self._overflow = {}
+
+    def pool(self, entity_type):
+        pool = self._pools.get(entity_type)
+        if pool is not None:
+            return pool
+        with self._pools_lock:
+            if entity_type not in self._pools:
+                generator = self.generators.get(entity_type) or self.generators.get("default", FALLBACK_GENERATOR)
+                self._pools[entity_type] = SurrogatePool(
+                    generator,
+                    self.faker,
+                    faker_lock=self._faker_lock,
+                    batch_size=self.batch_size,
+                    low_watermark=self.low_watermark,
+                    max_misses=self.max_misses,
+                    on_low=self._schedule,
+                    name=entity_type,
+                )
+            return self._pools[entity_type]
+
+    def take(self, entity_type, original=None):
+        """Return a surrogate for `entity_type`; the same one again for a repeated `original`."""
+        key = (entity_type, original)
+        if original is not None:
+            surrogate = self._assigned.get(key)
+            if surrogate is not None:
+                return surrogate
+        try:
+            surrogate = self.pool(entity_type).take()
+        except SurrogatePoolExhausted:
+            surrogate = self._overflow_pool(entity_type).take()
+        if original is None:
+            return surrogate
+        with self._assigned_lock:
+            return self._assigned.setdefault(key, surrogate)
+
+    def _overflow_pool(self, entity_type):
+        issued = self.pool(entity_type).issued
+        with self._pools_lock:
+            pool = self._overflow.get(entity_type)
+            if pool is None:
+                logger.warning("%s surrogates are exhausted; using fallback values", entity_type)
+                pool = self._overflow[entity_type] = SurrogatePool(
+                    FALLBACK_GENERATOR,
+                    self.faker,
+                    faker_lock=self._faker_lock,
+                    batch_size=self.batch_size,
+                    max_misses=self.max_misses,
+                    name=f"{entity_type} overflow",
+                )
+                pool.reserve(issued)
+            return pool
+
+    def reserve(self, mapping):
+        """Take in a stored {entity_type: {surrogate: original}} map.
+
+        Its surrogates are never handed out for other values, and its
+        originals get their stored surrogate from take().
+        """
+        with self._assigned_lock:
+            for entity_type, values in mapping.items():
+                for surrogate, original in values.items():
+                    self._assigned.setdefault((entity_type, original), surrogate)
+        for entity_type, values in mapping.items():
+            self.pool(entity_type).reserve(values)
+            overflow = self._overflow.get(entity_type)
+            if overflow is not None:
+                overflow.reserve(values)
+
+    def _schedule(self, pool):
+        with self._pools_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._refill_loop, name="surrogate-pools", daemon=True)
+                self._worker.start()
+        self._pending.put(pool)
+
+    def _refill_loop(self):
+        while True:
+            pool = self._pending.get()
+            if pool is None:
+                return
+            pool.fill()
+
+    def prefill(self, entity_types=None):
+        """Queue a batch for each entity type (all known types by default) in the background."""
+        for entity_type in self.generators if entity_types is None else entity_types:
+            pool = self.pool(entity_type)
+            pool._refill_requested = True
+            self._schedule(pool)
+
+    def operators(self, entity_types=None, param="lambda"):
+        """Presidio custom operators drawing from the pools, one per entity type.
+
+        `param` is the name of the params entry holding the function: "lambda"
+        for Presidio itself, "function" for the config in Utility/fake.py.
+        """
+        entity_types = self.generators.keys() if entity_types is None else entity_types
+
+        def operator(entity_type):
+            return OperatorConfig("custom", {param: lambda value: self.take(entity_type, value)})
+
+        return {entity_type: operator(entity_type) for entity_type in entity_types}
+
+    def stats(self):
+        return {
+            entity_type: {"ready": len(pool), "issued": len(pool.issued), "exhausted": pool.exhausted}
+            for entity_type, pool in list(self._pools.items())
+        }
+
+    def close(self):
+        """Stop the background thread once the queued refills are done."""
+        with self._pools_lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._pending.put(None)
+            worker.join()
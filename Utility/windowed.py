@@ -0,0 +1,122 @@
+import bisect
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from presidio_analyzer import EntityRecognizer
+
+# Places to cut a text, best first: paragraph breaks, line breaks, sentence
+# ends, any whitespace
+_BOUNDARIES = [re.compile(r"\n\s*\n"), re.compile(r"\n"), re.compile(r"[.!?][\"')\]]*\s+"), re.compile(r"\s+")]
+
+
+def _last_boundary(text, low, high):
+    """Return the end of the last best-ranked boundary inside text[low:high], or None."""
+    for boundary in _BOUNDARIES:
+        cut = None
+        for match in boundary.finditer(text, low, high):
+            cut = match.end()
+        if cut is not None and cut > low:
+            return cut
+    return None
+
+
+def _first_boundary(text, low, high):
+    """Return the end of the earliest line or sentence boundary inside text[low:high], or None.
+
+    Unlike the cut, the start of the next window takes the earliest boundary
+    of any kind, to keep as much of the overlap as possible.
+    """
+    ends = []
+    for boundary in _BOUNDARIES[:-1]:
+        match = boundary.search(text, low, high)
+        if match is not None and match.end() < high:
+            ends.append(match.end())
+    if ends:
+        return min(ends)
+    match = _BOUNDARIES[-1].search(text, low, high)
+    return match.end() if match is not None and match.end() < high else None
+
+
+def split_windows(text, window_size=100_000, overlap=2_000):
+    """Split `text` into overlapping windows, returned as (start, end) offsets.
+
+    Each window ends at a paragraph or sentence boundary in the second half
+    of `window_size` when there is one, and the next window starts at a
+    boundary about `overlap` characters before that, so an entity shorter
+    than the overlap is seen whole by at least one window.
+    """
+    if window_size <= overlap:
+        raise ValueError("window_size must be larger than overlap")
+    windows = []
+    start = 0
+    while True:
+        if len(text) - start <= window_size:
+            windows.append((start, len(text)))
+            return windows
+        limit = start + window_size
+        end = _last_boundary(text, start + window_size // 2, limit) or limit
+        windows.append((start, end))
+        next_start = _first_boundary(text, max(start + 1, end - overlap), end) or max(start + 1, end - overlap)
+        start = next_start
+
+
+class WindowedAnalyzer:
+    """Run an AnalyzerEngine over long texts one window at a time.
+
+    Texts longer than `window_size` characters are split with
+    split_windows(), each window is analyzed on its own (on `workers`
+    threads when more than one), and the results are moved back to offsets
+    in the whole text. Spans found twice in the overlap between two windows,
+    or cut short at a window edge, are dropped with
+    EntityRecognizer.remove_duplicates. The spaCy Doc of only one window per
+    worker exists at a time, so memory does not grow with the text.
+
+    analyze() takes the same arguments as AnalyzerEngine.analyze, and every
+    other attribute (registry, get_recognizers, ...) is the wrapped
+    analyzer's, so it can stand in for one, e.g. as the `_analyzer` of a
+    PresidioReversibleAnonymizer. Precomputed nlp_artifacts only apply to
+    texts that fit in one window.
+    """
+
+    def __init__(self, analyzer, window_size=100_000, overlap=2_000, workers=1):
+        self.analyzer = analyzer
+        self.window_size = window_size
+        self.overlap = overlap
+        self.workers = workers
+
+    def __getattr__(self, name):
+        return getattr(self.analyzer, name)
+
+    def analyze(self, text, language, entities=None, **kwargs):
+        if len(text) <= self.window_size:
+            return self.analyzer.analyze(text, language, entities=entities, **kwargs)
+        kwargs.pop("nlp_artifacts", None)
+
+        windows = split_windows(text, self.window_size, self.overlap)
+
+        def analyze_window(window):
+            start, end = window
+            results = self.analyzer.analyze(text[start:end], language, entities=entities, **kwargs)
+            for result in results:
+                result.start += start
+                result.end += start
+            return results
+
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                window_results = list(executor.map(analyze_window, windows))
+        else:
+            window_results = [analyze_window(window) for window in windows]
+
+        # Only spans touching an overlap can have been found twice
+        overlaps = [(windows[index + 1][0], windows[index][1]) for index in range(len(windows) - 1)]
+        overlap_starts = [low for low, _ in overlaps]
+        kept = []
+        shared = []
+        for results in window_results:
+            for result in results:
+                index = bisect.bisect_right(overlap_starts, result.end) - 1
+                touches = index >= 0 and result.start <= overlaps[index][1] and result.end >= overlaps[index][0]
+                (shared if touches else kept).append(result)
+        return kept + EntityRecognizer.remove_duplicates(shared)
+
@@ -0,0 +1,122 @@
+import argparse
+import json
+import random
+import re
+
+from faker import Faker
+
+from Utility.surrogate_generators import FAKER_GENERATORS
+
+# Sentences carrying PII, taken from the sample texts in Utility/*.py and the
+# witness statement in main.py
+PII_TEMPLATES = [
+    "My name is {PERSON}, I am from {ORGANIZATION}.",
+    "My phone number is {PHONE_NUMBER}, my email is {EMAIL_ADDRESS}.",
+    "My credit card number is {CREDIT_CARD}.",
+    "I live in {LOCATION}, my passport number is {US_PASSPORT}, and my IP address is {IP_ADDRESS}.",
+    "As per our {LEGAL_TERM}, I cannot disclose the Bank Account Number: {BANK_ACCOUNT} of our client.",
+    "My name is {PERSON} and on {DATE_TIME}, my wallet was stolen in the vicinity of {LOCATION} during a bike trip.",
+    "Firstly, the wallet contains my credit card with number {CREDIT_CARD}, which is registered under my name "
+    "and linked to my bank account, {IBAN_CODE}.",
+    "Additionally, the wallet had a driver's license - DL No: {US_DRIVER_LICENSE} issued to my name.",
+    "It also houses my Social Security Number, {US_SSN}.",
+    "What's more, I had my polish identity card there, with the number {POLISH_ID}.",
+    "I believe It was stolen at {TIME}.",
+    "In case any information arises regarding my wallet, please reach out to me on my phone number, "
+    "{PHONE_NUMBER}, or through my personal email, {EMAIL_ADDRESS}.",
+    "They will be reachable at their official email, {EMAIL_ADDRESS}.",
+    "My representative there is {PERSON} (her business phone: {PHONE_NUMBER}).",
+    "The statement is also available at {URL} from {IPV6}.",
+]
+
+# Sentences without PII from the same texts, used to dilute the entity density
+FILLER_SENTENCES = [
+    "This wallet contains some very important things to me.",
+    "I would like this data to be secured and protected in all possible ways.",
+    "Please consider this information to be highly confidential and respect my privacy.",
+    "The bank has been informed about the stolen credit card and necessary actions have been taken from their end.",
+    "Thank you for your assistance.",
+    "Hello Officer, this is my testimony regarding the loss of my wallet.",
+    "I cannot disclose any further details of our client.",
+]
+
+# Values for the placeholders that the shared Faker generators do not cover
+# or that must match the custom recognizers in the scripts
+CORPUS_GENERATORS = {
+    **FAKER_GENERATORS,
+    "LOCATION": lambda fake: fake.city(),
+    "DATE_TIME": lambda fake: fake.date(pattern="%B %d, %Y"),
+    "US_DRIVER_LICENSE": lambda fake: fake.numerify("#########"),
+    "LEGAL_TERM": lambda fake: fake.random_element(
+        ["Confidentiality Agreement", "Non-Disclosure Agreement", "NDA"]
+    ),
+    "BANK_ACCOUNT": lambda fake: fake.numerify("##########"),
+    "POLISH_ID": lambda fake: fake.bothify(text="???######", letters="ABCDEFGHIJKLMNOPQRSTUVWXYZ"),
+}
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+def generate_document(fake, rng, size=2000, density=0.5):
+    """Return (text, entity_count) for one document of about `size` characters.
+
+    Each sentence is a PII template with probability `density` and a filler
+    sentence otherwise.
+    """
+    sentences = []
+    length = 0
+    entities = 0
+    while length < size:
+        if rng.random() < density:
+            template = rng.choice(PII_TEMPLATES)
+            entities += len(_PLACEHOLDER.findall(template))
+            sentence = _PLACEHOLDER.sub(lambda match: str(CORPUS_GENERATORS[match.group(1)](fake)), template)
+        else:
+            sentence = rng.choice(FILLER_SENTENCES)
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return " ".join(sentences), entities
+
+
+def generate_corpus(documents=100, size=2000, density=0.5, seed=0):
+    """Return (texts, stats) for a reproducible synthetic corpus."""
+    rng = random.Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
+    texts = []
+    entities = 0
+    for _ in range(documents):
+        text, count = generate_document(fake, rng, size=size, density=density)
+        texts.append(text)
+        entities += count
+    characters = sum(len(text) for text in texts)
+    stats = {
+        "documents": documents,
+        "characters": characters,
+        "entities": entities,
+        "entities_per_1k_chars": 1000 * entities / characters if characters else 0.0,
+        "size": size,
+        "density": density,
+        "seed": seed,
+    }
+    return texts, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic PII corpus, one document per line.")
+    parser.add_argument("output", help="text file to write")
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--size", type=int, default=2000, help="approximate characters per document")
+    parser.add_argument("--density", type=float, default=0.5, help="share of sentences carrying PII (0-1)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts, stats = generate_corpus(args.documents, args.size, args.density, args.seed)
+    with open(args.output, "w") as output_file:
+        for text in texts:
+            output_file.write(text + "\n")
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import spacy
+
+from Utility.nlp_engine import BLANK_MODEL, MODEL_TIERS, NER_ONLY_EXCLUDE, get_nlp_engine, resolve_model
+from Utility.parallel import memory_usage
+from benchmarks.corpus import generate_corpus
+
+
+def measure_tier(tier, ner_only=True, documents=50, size=2000):
+    """Load one tier in this process and return its load time, memory and NER latency."""
+    model_name = resolve_model(tier)
+    # Presidio would try to download a missing model; report it instead
+    if model_name != BLANK_MODEL and not (spacy.util.is_package(model_name) or os.path.exists(model_name)):
+        return {"model": model_name, "error": "not installed"}
+
+    texts, _ = generate_corpus(documents, size)
+    rss_before, pss_before = memory_usage()
+
+    started = time.perf_counter()
+    engine = get_nlp_engine(model_name, ner_only=ner_only)
+    load_seconds = time.perf_counter() - started
+    rss_after, pss_after = memory_usage()
+
+    nlp = engine.nlp["en"]
+    # Straight through the pipeline, bypassing the engine's artifact cache
+    started = time.perf_counter()
+    entities = sum(len(nlp(text).ents) for text in texts)
+    seconds = time.perf_counter() - started
+
+    result = {
+        "model": model_name,
+        "pipeline": list(nlp.pipe_names),
+        "load_seconds": load_seconds,
+        "rss_bytes": rss_after - rss_before,
+        "pss_bytes": pss_after - pss_before if pss_before is not None and pss_after is not None else None,
+        "ms_per_doc": 1000 * seconds / len(texts),
+        "entities": entities,
+    }
+    if ner_only and model_name != BLANK_MODEL:
+        # The excluded components must not change what the NER finds
+        full = spacy.load(model_name)
+        result["docs_with_different_entities"] = sum(
+            _entities(doc) != _entities(full_doc)
+            for doc, full_doc in zip(nlp.pipe(texts), full.pipe(texts))
+        )
+    return result
+
+
+def _entities(doc):
+    return [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report load time, memory and NER latency of the spaCy model tiers.")
+    parser.add_argument("--tiers", nargs="*", default=list(MODEL_TIERS), help="tiers or model names")
+    parser.add_argument("--full", action="store_true", help=f"keep {', '.join(NER_ONLY_EXCLUDE)} in the pipeline")
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    report = {}
+    for tier in args.tiers:
+        # One fresh interpreter per tier, so each starts from the same baseline
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            result = pool.apply(measure_tier, (tier, not args.full, args.documents, args.size))
+        report[tier] = result
+        if "error" in result:
+            print(f"{tier:>6}: {result['model']} {result['error']}")
+            continue
+        print(f"{tier:>6}: load {result['load_seconds']:6.2f}s rss +{result['rss_bytes'] / 2**20:6.0f} MiB "
+              f"{result['ms_per_doc']:7.2f} ms/doc  pipeline {','.join(result['pipeline']) or '-'}")
+        if "docs_with_different_entities" in result:
+            different = result["docs_with_different_entities"]
+            print(f"        entities: {f'{different} of {args.documents} documents differ' if different else 'same'} "
+                  "as with the full pipeline")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
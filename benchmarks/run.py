@@ -0,0 +1,184 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+
+from presidio_analyzer import Pattern
+from presidio_anonymizer import AnonymizerEngine
+
+from Utility.combined_recognizer import CombinedPatternRecognizer
+from Utility.nlp_engine import build_analyzer, get_nlp_engine, needs_ner
+from Utility.presets import DEFAULT_ENTITIES, DEFAULT_OPERATORS
+from Utility.profiling import RecognizerProfiler
+from Utility.surrogate_pool import SurrogatePools
+from benchmarks.corpus import generate_corpus
+
+# Entities found by pattern recognizers alone
+REGEX_ENTITIES = [
+    "PHONE_NUMBER",
+    "EMAIL_ADDRESS",
+    "CREDIT_CARD",
+    "IP_ADDRESS",
+    "IBAN_CODE",
+    "US_DRIVER_LICENSE",
+    "US_SSN",
+    "URL",
+]
+
+# Same patterns as Utility/legal.py
+LEGAL_PATTERNS = [
+    Pattern(name="party_name_pattern", regex=r"\b(Nomura)\b", score=0.5),
+    Pattern(name="contract_terms_pattern", regex=r"\b(Confidentiality Agreement|Non-Disclosure Agreement|NDA)\b", score=0.5),
+    Pattern(name="financial_info_pattern", regex=r"\b(Bank Account Number: \d{10,12})\b", score=0.5),
+]
+
+
+def _legal_recognizer():
+    return CombinedPatternRecognizer(patterns=[("LEGAL_TERM", pattern) for pattern in LEGAL_PATTERNS])
+
+
+def _faker_operators():
+    return SurrogatePools().operators(DEFAULT_ENTITIES)
+
+
+# name -> (entities, extra recognizers, operators factory or None for analysis only)
+CONFIGURATIONS = {
+    "regex": (REGEX_ENTITIES, lambda: [], None),
+    "ner": (DEFAULT_ENTITIES, lambda: [], None),
+    "legal": (DEFAULT_ENTITIES + ["LEGAL_TERM"], lambda: [_legal_recognizer()], None),
+    "faker": (DEFAULT_ENTITIES, lambda: [], _faker_operators),
+    "operators": (DEFAULT_ENTITIES, lambda: [], lambda: DEFAULT_OPERATORS),
+}
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _peak_rss():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_configuration(name, texts, model="en_core_web_lg", warmup=5, profile=False, ner_only=False):
+    """Analyze (and anonymize, for operator configurations) every text and return the metrics.
+
+    With `profile`, the metrics include the per-recognizer totals of a
+    RecognizerProfiler; the wrappers add a little overhead to every call.
+    """
+    entities, recognizers, operators_factory = CONFIGURATIONS[name]
+
+    load_started = time.perf_counter()
+    # The regex configuration runs without the spaCy model
+    nlp_engine = get_nlp_engine(model, ner_only=ner_only) if needs_ner(entities) else None
+    analyzer = build_analyzer(nlp_engine, recognizers=recognizers(), entities=entities)
+    anonymizer = AnonymizerEngine()
+    operators = operators_factory() if operators_factory else None
+    load_seconds = time.perf_counter() - load_started
+
+    def process(text):
+        results = analyzer.analyze(text=text, entities=entities, language="en")
+        if operators is not None:
+            anonymizer.anonymize(text=text, analyzer_results=results, operators=operators)
+        return results
+
+    for text in texts[:warmup]:
+        process(text)
+
+    profiler = None
+    if profile:
+        profiler = RecognizerProfiler()
+        profiler.instrument(analyzer)
+
+    latencies = []
+    found = 0
+    started = time.perf_counter()
+    for text in texts:
+        text_started = time.perf_counter()
+        found += len(process(text))
+        latencies.append(time.perf_counter() - text_started)
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    characters = sum(len(text) for text in texts)
+    metrics = {
+        "documents": len(texts),
+        "characters": characters,
+        "entities_found": found,
+        "seconds": seconds,
+        "load_seconds": load_seconds,
+        "docs_per_sec": len(texts) / seconds if seconds else 0.0,
+        "chars_per_sec": characters / seconds if seconds else 0.0,
+        "latency_p50_ms": 1000 * _percentile(latencies, 0.50),
+        "latency_p99_ms": 1000 * _percentile(latencies, 0.99),
+        "peak_rss_bytes": _peak_rss(),
+    }
+    if profiler is not None:
+        metrics["profile"] = profiler.stats()
+        profiler.restore()
+    return metrics
+
+
+def _run_isolated(name, texts, model, warmup, profile, ner_only):
+    # A fresh interpreter per configuration, so peak RSS is not inherited
+    # from the configurations measured before it
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_configuration, (name, texts, model, warmup, profile, ner_only))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure analyzer and anonymizer throughput on a synthetic corpus.")
+    parser.add_argument("--configs", nargs="*", default=list(CONFIGURATIONS), choices=list(CONFIGURATIONS))
+    parser.add_argument("--corpus", help="text file with one document per line (generated if omitted)")
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--size", type=int, default=2000, help="approximate characters per document")
+    parser.add_argument("--density", type=float, default=0.5, help="share of sentences carrying PII (0-1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default="en_core_web_lg", help="model name or tier (sm, md, lg, blank)")
+    parser.add_argument("--ner-only", action="store_true", help="load only the NER components of the model")
+    parser.add_argument("--warmup", type=int, default=5, help="documents processed before timing starts")
+    parser.add_argument("--profile", action="store_true", help="include per-recognizer timings in the report")
+    parser.add_argument("--in-process", action="store_true", help="run every configuration in this process")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as corpus_file:
+            texts = [line.rstrip("\n") for line in corpus_file if line.strip()]
+        corpus = {"path": args.corpus, "documents": len(texts), "characters": sum(len(text) for text in texts)}
+    else:
+        texts, corpus = generate_corpus(args.documents, args.size, args.density, args.seed)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "model": args.model,
+        "ner_only": args.ner_only,
+        "corpus": corpus,
+        "results": {},
+    }
+    for name in args.configs:
+        if args.in_process:
+            metrics = run_configuration(name, texts, args.model, args.warmup, args.profile, args.ner_only)
+        else:
+            metrics = _run_isolated(name, texts, args.model, args.warmup, args.profile, args.ner_only)
+        report["results"][name] = metrics
+        print(f"{name:>10}: {metrics['docs_per_sec']:8.1f} docs/sec {metrics['chars_per_sec']:10.0f} chars/sec "
+              f"p50 {metrics['latency_p50_ms']:6.1f} ms p99 {metrics['latency_p99_ms']:6.1f} ms "
+              f"peak rss {metrics['peak_rss_bytes'] / 2**20:.0f} MiB")
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
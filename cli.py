@@ -0,0 +1,514 @@
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from functools import cached_property
+
+# Everything heavy (boto3, langchain, FAISS, Presidio, Faker) is imported
+# inside the subcommands that need it, so `--help`, `inspect-map` and
+# `deanonymize` with a local map start without paying for it
+_STARTED = time.perf_counter()
+_timings = []
+
+
+@contextmanager
+def timed(label):
+    """Record how long the block took, for the --timings report."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings.append((label, time.perf_counter() - started))
+
+
+def _interpreter_startup():
+    # Seconds between process start and this module running, from /proc (Linux only)
+    try:
+        with open("/proc/self/stat") as stat_file:
+            start_ticks = int(stat_file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    process_age = uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    return max(0.0, process_age - (time.perf_counter() - _STARTED))
+
+
+def print_timings():
+    startup = _interpreter_startup()
+    lines = ["Startup timings:"]
+    if startup is not None:
+        lines.append(f"  {'interpreter startup':<36} {1000 * startup:8.1f} ms")
+    for label, seconds in _timings:
+        lines.append(f"  {label:<36} {1000 * seconds:8.1f} ms")
+    lines.append(f"  {'total (cli)':<36} {1000 * (time.perf_counter() - _STARTED):8.1f} ms")
+    print("\n".join(lines), file=sys.stderr)
+
+
+def read_map(path):
+    with open(path) as map_file:
+        return json.load(map_file)
+
+
+def custom_recognizer():
+    """The POLISH_ID/TIME recognizer added to every anonymizer, as in main.py."""
+    from Utility.combined_recognizer import CombinedPatternRecognizer
+    from Utility.presets import CUSTOM_PATTERNS
+
+    return CombinedPatternRecognizer(patterns=CUSTOM_PATTERNS)
+
+
+class Context:
+    """Settings from the environment and clients created on first use."""
+
+    def __init__(self, args):
+        self.args = args
+        with timed("load .env"):
+            from dotenv import load_dotenv
+
+            load_dotenv()
+        self.region = os.getenv("AWS_REGION")
+        self.bucket = getattr(args, "bucket", None) or os.getenv("BUCKET_NAME")
+        self.embeddings_key = os.getenv("EMBEDDINGS_KEY", "embeddings.faiss")
+        self.map_key = os.getenv("ANONYMIZATION_MAP_KEY", "anonymization_map.json")
+        self.store_key = os.getenv("ANONYMIZATION_STORE_KEY", "anonymization_store")
+        self.store_path = os.getenv("ANONYMIZATION_STORE_PATH")
+        self.cache_path = os.getenv("EMBEDDING_CACHE_PATH", "/tmp/embedding_cache.sqlite")
+        self.cache_key = os.getenv("EMBEDDING_CACHE_KEY")
+        self.spacy_model = os.getenv("SPACY_MODEL", "lg")
+        self.pseudonym_secret = os.getenv("PSEUDONYM_SECRET")
+
+    @cached_property
+    def boto3(self):
+        with timed("import boto3"):
+            import boto3
+        return boto3
+
+    @cached_property
+    def s3_client(self):
+        boto3 = self.boto3
+        with timed("create s3 client"):
+            return boto3.client("s3", region_name=self.region)
+
+    @cached_property
+    def bedrock_client(self):
+        boto3 = self.boto3
+        with timed("create bedrock client"):
+            return boto3.client(service_name="bedrock-runtime", region_name=self.region)
+
+    @cached_property
+    def embeddings(self):
+        bedrock_client = self.bedrock_client
+        with timed("import embeddings"):
+            from langchain_community.embeddings import BedrockEmbeddings
+
+            from Utility.concurrent_embeddings import ConcurrentEmbeddings
+            from Utility.embedding_cache import CachedEmbeddings
+        return CachedEmbeddings(
+            ConcurrentEmbeddings(BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=bedrock_client)),
+            path=self.cache_path,
+            s3_client=self.s3_client,
+            bucket=self.bucket,
+            s3_key=self.cache_key,
+        )
+
+    @cached_property
+    def index_store(self):
+        with timed("import faiss index"):
+            from Utility.faiss_index import VersionedIndexStore
+        return VersionedIndexStore(self.s3_client, self.bucket, self.embeddings_key)
+
+    def load_map(self, path=None, s3_key=None):
+        """Read an anonymization map from a local file, or from S3 (empty if missing there)."""
+        if path:
+            return read_map(path)
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=s3_key or self.map_key)
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return {}
+            raise
+        return json.loads(response["Body"].read())
+
+    def save_map(self, mapping):
+        """Upload the map as JSON, and as the trie store query workers memory-map."""
+        body = json.dumps(mapping, indent=4).encode("utf-8")
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.map_key, Body=body)
+        with timed("build mapping store"):
+            from Utility.mapping_store import MappingStore
+
+            store = MappingStore.build(mapping)
+        store.upload(self.s3_client, self.bucket, self.store_key, self.store_path)
+
+    def load_store(self):
+        """The trie store uploaded by save_map(), fetched once per host; None if there is none yet."""
+        with timed("open mapping store"):
+            from Utility.mapping_store import MappingStore
+
+            return MappingStore.download(self.s3_client, self.bucket, self.store_key, self.store_path)
+
+    def anonymizer(self, mapping=None, store=None):
+        """PresidioReversibleAnonymizer with the POLISH_ID/TIME recognizer and operators of main.py.
+
+        Starts from `mapping`, or with a MappingStore as `store` from an
+        empty mapping whose operators give known values their stored
+        surrogate and never hand out one the store already uses.
+        """
+        with timed("import presidio"):
+            from langchain_experimental.data_anonymizer import PresidioReversibleAnonymizer
+
+            from Utility.presets import CUSTOM_ENTITIES
+            from Utility.surrogate_pool import SurrogatePools
+            from Utility.windowed import WindowedAnalyzer
+
+        with timed("create anonymizer"):
+            # Surrogates of the stored map stay with their originals
+            pools = SurrogatePools()
+            pools.reserve({entity_type: (mapping or {}).get(entity_type, {}) for entity_type in CUSTOM_ENTITIES})
+            anonymizer = PresidioReversibleAnonymizer(faker_seed=42, deanonymizer_mapping=mapping)
+            anonymizer.add_recognizer(custom_recognizer())
+            anonymizer.add_operators(pools.operators(CUSTOM_ENTITIES))
+            if store is not None:
+                anonymizer.add_operators(store.reuse_known(anonymizer.operators))
+            # Long documents are analyzed in windows; relies on the private `_analyzer`
+            anonymizer._analyzer = WindowedAnalyzer(anonymizer._analyzer)
+        return anonymizer
+
+
+def read_docx(file_path):
+    from docx import Document as DocxDocument
+
+    return "\n".join(paragraph.text for paragraph in DocxDocument(file_path).paragraphs)
+
+
+def anonymize_chunk_first(context, document_content, workers=None):
+    """Split the document, anonymize the chunks in parallel and merge the surrogates into the map.
+
+    Returns the anonymized chunks and the mapping of the surrogates they use.
+    """
+    if not context.pseudonym_secret:
+        raise SystemExit("--chunk-first needs PSEUDONYM_SECRET, the key every worker derives surrogates from")
+    with timed("import presidio"):
+        from Utility.keyed_pseudonymizer import KeyedPseudonymizer
+        from Utility.nlp_engine import build_analyzer, get_nlp_engine
+        from Utility.parallel import anonymize_chunks
+        from Utility.presets import CUSTOM_ENTITIES, DEFAULT_ENTITIES
+
+    entities = DEFAULT_ENTITIES + CUSTOM_ENTITIES
+    with timed("load analyzer"):
+        nlp_engine = get_nlp_engine(context.spacy_model, ner_only=True)
+        analyzer = build_analyzer(nlp_engine, recognizers=[custom_recognizer()], entities=entities)
+    # Surrogates already in the stored map keep their value, so documents
+    # indexed before still deanonymize; a keyed surrogate landing on one of
+    # them for another value is reported in `pseudonymizer.conflicts`
+    mapping = context.load_map()
+    pseudonymizer = KeyedPseudonymizer(context.pseudonym_secret)
+    pseudonymizer.reserve(mapping)
+    with timed("anonymize"):
+        chunks, new_mapping = anonymize_chunks(
+            [document_content],
+            pseudonymizer,
+            analyzer=analyzer,
+            entities=entities,
+            workers=workers,
+        )
+
+    if pseudonymizer.conflicts:
+        conflicts = ", ".join(
+            f"{entity_type} {surrogate!r}"
+            for entity_type, surrogates in sorted(pseudonymizer.conflicts.items())
+            for surrogate in sorted(surrogates)
+        )
+        raise SystemExit(f"Surrogates standing for more than one value: {conflicts}")
+    for entity_type, values in new_mapping.items():
+        stored = mapping.setdefault(entity_type, {})
+        for surrogate, original in values.items():
+            if stored.setdefault(surrogate, original) != original:
+                raise SystemExit(f"{entity_type} surrogate {surrogate!r} already stands for another value in the map")
+    context.save_map(mapping)
+    return chunks, new_mapping
+
+
+def command_index(args):
+    context = Context(args)
+    docx_key = args.docx_key or os.getenv("DOCX_KEY")
+    if not docx_key:
+        raise SystemExit("No document given; pass --docx-key or set DOCX_KEY")
+    local_path = os.path.join("/tmp", os.path.basename(docx_key))
+    context.s3_client.download_file(context.bucket, docx_key, local_path)
+    document_content = read_docx(local_path)
+
+    if args.chunk_first:
+        chunks, mapping = anonymize_chunk_first(context, document_content, args.workers)
+    else:
+        anonymizer = context.anonymizer(context.load_map())
+        with timed("anonymize"):
+            anonymized_content = anonymizer.anonymize(document_content)
+        mapping = anonymizer.deanonymizer_mapping
+        context.save_map(mapping)
+
+        with timed("import text splitter"):
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+        chunks = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100).split_text(anonymized_content)
+
+    from Utility.deanonymizer import MAPPING_KEYS, chunk_mapping_keys
+    from Utility.faiss_index import upsert_document
+
+    # The fake values of each chunk, so queries can deanonymize per chunk
+    with timed("find mapping keys"):
+        chunk_metadata = [{MAPPING_KEYS: keys} for keys in chunk_mapping_keys(chunks, mapping)]
+
+    embeddings = context.embeddings
+    store, version = context.index_store.load(embeddings)
+    with timed("embed and index"):
+        store, added, removed = upsert_document(store, embeddings, docx_key, chunks, chunk_metadata=chunk_metadata)
+    embeddings.sync()
+    version = context.index_store.save(store, version)
+    print(f"Indexed {docx_key} as version {version}: {added} chunks added, {removed} removed")
+    print("Embedding cache:", embeddings.stats())
+
+
+def command_ask(args):
+    context = Context(args)
+    from Utility.questions import load_questions
+
+    questions = list(args.questions)
+    if args.questions_file:
+        questions += load_questions(args.questions_file)
+    if not questions:
+        raise SystemExit("No questions given")
+
+    if args.map:
+        with timed("open mapping store"):
+            from Utility.mapping_store import MappingStore
+
+            mapping_store = MappingStore.build(read_map(args.map))
+    else:
+        mapping_store = context.load_store()
+    if mapping_store is None:
+        raise SystemExit("No mapping store saved yet; run `index` first or pass --map")
+    anonymizer = context.anonymizer(store=mapping_store)
+    store, _ = context.index_store.load(context.embeddings)
+    if store is None:
+        raise SystemExit("No index saved yet; run `index` first")
+
+    with timed("import langchain"):
+        from operator import itemgetter
+
+        from langchain_community.chat_models import BedrockChat
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_core.runnables import RunnableGenerator, RunnableLambda, RunnableParallel, RunnablePassthrough
+
+        from Utility.deanonymizer import Deanonymizer, StreamingDeanonymizer, scoped_mapping
+        from Utility.questions import answer_questions, print_answers, serialized
+
+    prompt = ChatPromptTemplate.from_template(
+        "Answer the question based only on the following context:\n{context}\n\nQuestion: {anonymized_question}\n"
+    )
+    model = BedrockChat(model_id=args.model_id, client=context.bedrock_client)
+    anonymize = serialized(anonymizer.anonymize)
+    inputs = RunnableParallel(
+        question=RunnablePassthrough(),
+        anonymized_question=RunnableLambda(anonymize),
+    )
+
+    session_deanonymizer = Deanonymizer.from_anonymizer(anonymizer, anonymize.lock, version=lambda: anonymize.calls)
+
+    def start_answer(documents):
+        # Only the originals of the retrieved chunks' fake values are looked
+        # up in the store, plus the fake values made up for the question
+        # itself. False for chunks indexed without their keys: then the
+        # answer is restored whole, against the entire store
+        mapping = scoped_mapping(
+            documents,
+            lambda entity_type, fake_value: mapping_store.original(fake_value, entity_type),
+        )
+        if mapping is None:
+            return False
+        with anonymize.lock:
+            session = anonymizer.deanonymizer_mapping
+        for entity_type, values in session.items():
+            mapping[entity_type] = {**mapping.get(entity_type, {}), **values}
+        return StreamingDeanonymizer(Deanonymizer(mapping))
+
+    def restore_whole(answer):
+        return mapping_store.deanonymize(session_deanonymizer.deanonymize("".join(answer)))
+
+    # The retrieved documents arrive before the answer tokens, which are
+    # restored as they stream in
+    def restore(chunks):
+        documents, answer, streaming = [], [], None
+        for chunk in chunks:
+            documents = chunk.get("documents", documents)
+            if "answer" not in chunk:
+                continue
+            if streaming is None:
+                streaming = start_answer(documents)
+            if streaming:
+                restored = streaming.feed(chunk["answer"])
+                if restored:
+                    yield restored
+            else:
+                answer.append(chunk["answer"])
+        if streaming:
+            restored = streaming.flush()
+            if restored:
+                yield restored
+        elif streaming is False:
+            yield restore_whole(answer)
+
+    async def arestore(chunks):
+        documents, answer, streaming = [], [], None
+        async for chunk in chunks:
+            documents = chunk.get("documents", documents)
+            if "answer" not in chunk:
+                continue
+            if streaming is None:
+                streaming = start_answer(documents)
+            if streaming:
+                restored = streaming.feed(chunk["answer"])
+                if restored:
+                    yield restored
+            else:
+                answer.append(chunk["answer"])
+        if streaming:
+            restored = streaming.flush()
+            if restored:
+                yield restored
+        elif streaming is False:
+            yield restore_whole(answer)
+
+    # The retrieved documents are kept next to the answer, so deanonymization
+    # is limited to the fake values they contain
+    chain = (
+        inputs
+        | RunnablePassthrough.assign(documents=itemgetter("anonymized_question") | store.as_retriever())
+        | RunnablePassthrough.assign(
+            answer={
+                "context": itemgetter("documents"),
+                "anonymized_question": itemgetter("anonymized_question"),
+            }
+            | prompt
+            | model
+            | StrOutputParser()
+        )
+        | RunnableGenerator(restore, arestore)
+    )
+    if args.stream:
+        # One question at a time, printing the answer as the tokens arrive
+        for question in questions:
+            print(f"Q: {question}\nA: ", end="", flush=True)
+            for text in chain.stream(question):
+                print(text, end="", flush=True)
+            print("\n")
+        return
+    print_answers(answer_questions(chain, questions, max_concurrency=args.concurrency))
+
+
+def command_inspect_map(args):
+    if args.map:
+        mapping = read_map(args.map)
+    else:
+        mapping = Context(args).load_map(s3_key=args.s3_key)
+
+    if args.find is not None:
+        for entity_type, values in sorted(mapping.items()):
+            for fake_value, original in values.items():
+                if args.find in (fake_value, original):
+                    print(f"{entity_type}\t{fake_value}\t{original}")
+        return
+
+    entity_types = [args.type] if args.type else sorted(mapping)
+    for entity_type in entity_types:
+        values = mapping.get(entity_type, {})
+        print(f"{entity_type}: {len(values)} values")
+        if args.type:
+            for fake_value, original in values.items():
+                print(f"  {fake_value}\t{original}")
+    if not args.type:
+        print(f"total: {sum(len(values) for values in mapping.values())} values")
+
+
+def command_deanonymize(args):
+    with timed("import deanonymizer"):
+        from Utility.deanonymizer import Deanonymizer
+
+    if args.map is None:
+        deanonymizer = Context(args).load_store()
+        if deanonymizer is None:
+            raise SystemExit("No mapping store saved yet; run `index` first or pass --map")
+    elif os.path.isdir(args.map):
+        with timed("open mapping store"):
+            from Utility.mapping_store import MappingStore
+
+            deanonymizer = MappingStore.load(args.map)
+    else:
+        mapping = read_map(args.map)
+        with timed("build automaton"):
+            deanonymizer = Deanonymizer(mapping)
+
+    if args.input == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.input) as input_file:
+            text = input_file.read()
+    with timed("deanonymize"):
+        restored = deanonymizer.deanonymize(text)
+    sys.stdout.write(restored)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Anonymized document Q&A over Bedrock and FAISS.")
+    parser.add_argument("--timings", action="store_true", help="print a startup and step timing report to stderr")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    index = subcommands.add_parser("index", help="anonymize a DOCX from S3 and add it to the FAISS index")
+    index.add_argument("--docx-key", help="S3 key of the document (default: $DOCX_KEY)")
+    index.add_argument("--bucket", help="S3 bucket (default: $BUCKET_NAME)")
+    index.add_argument("--chunk-first", action="store_true",
+                       help="split first and anonymize the chunks on several cores (needs $PSEUDONYM_SECRET)")
+    index.add_argument("--workers", type=int, help="worker processes for --chunk-first (default: one per core)")
+    index.set_defaults(handler=command_index)
+
+    ask = subcommands.add_parser("ask", help="answer questions over the indexed documents")
+    ask.add_argument("questions", nargs="*")
+    ask.add_argument("--questions-file", default=os.getenv("QUESTIONS_FILE"))
+    ask.add_argument("--concurrency", type=int, default=int(os.getenv("QUESTION_CONCURRENCY", "8")))
+    ask.add_argument("--map", help="local anonymization map (default: the mapping store in S3)")
+    ask.add_argument("--stream", action="store_true", help="print each answer as it is generated")
+    ask.add_argument("--bucket", help="S3 bucket (default: $BUCKET_NAME)")
+    ask.add_argument("--model-id", default="anthropic.claude-3-5-sonnet-20240620-v1:0")
+    ask.set_defaults(handler=command_ask)
+
+    inspect_map = subcommands.add_parser("inspect-map", help="summarize or search an anonymization map")
+    inspect_map.add_argument("map", nargs="?", help="local map file (default: read from S3)")
+    inspect_map.add_argument("--s3-key", help="S3 key of the map (default: $ANONYMIZATION_MAP_KEY)")
+    inspect_map.add_argument("--bucket", help="S3 bucket (default: $BUCKET_NAME)")
+    inspect_map.add_argument("--type", help="list the values of one entity type")
+    inspect_map.add_argument("--find", help="show the entries whose fake or original value is this")
+    inspect_map.set_defaults(handler=command_inspect_map)
+
+    deanonymize = subcommands.add_parser("deanonymize", help="restore original values in a text")
+    deanonymize.add_argument("input", nargs="?", default="-", help="text file (default: stdin)")
+    deanonymize.add_argument("--map", help="local anonymization map, or a mapping store directory (default: the store in S3)")
+    deanonymize.add_argument("--bucket", help="S3 bucket (default: $BUCKET_NAME)")
+    deanonymize.set_defaults(handler=command_deanonymize)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        args.handler(args)
+    finally:
+        if args.timings:
+            print_timings()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,7 @@
 import re
 import json
 from langchain_experimental.data_anonymizer import PresidioReversibleAnonymizer
-from presidio_analyzer import Pattern, PatternRecognizer
-from faker import Faker
+from presidio_analyzer import Pattern
 from presidio_anonymizer.entities import OperatorConfig
 
 from langchain_community.vectorstores import FAISS
@@ -14,6 +13,7 @@ from operator import itemgetter
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import (
+    RunnableGenerator,
     RunnableLambda,
     RunnableParallel,
     RunnablePassthrough,
@@ -25,16 +25,27 @@ import os
 from dotenv import load_dotenv
 from langchain_community.embeddings import BedrockEmbeddings
 from langchain_community.chat_models import BedrockChat
+from Utility.combined_recognizer import CombinedPatternRecognizer
+from Utility.concurrent_embeddings import ConcurrentEmbeddings
+from Utility.deanonymizer import Deanonymizer
+from Utility.questions import answer_questions, load_questions, print_answers, serialized
+from Utility.surrogate_pool import SurrogatePools
 
 # Load environment variables from .env file
 load_dotenv()
 AWS_REGION = os.getenv("AWS_REGIONS")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
+QUESTIONS_FILE = os.getenv("QUESTIONS_FILE")  # Optional file with one question per line
+QUESTION_CONCURRENCY = int(os.getenv("QUESTION_CONCURRENCY", "8"))  # Questions answered at once
 
 # Initialize AWS clients
 s3_client = boto3.client("s3", region_name=AWS_REGION)
 bedrock_client = boto3.client(service_name="bedrock-runtime", region_name=AWS_REGION)
-bedrock_embeddings = BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=bedrock_client)
+
+# Embed chunks concurrently, backing off when Bedrock throttles
+bedrock_embeddings = ConcurrentEmbeddings(
+    BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=bedrock_client)
+)
 
 # Sample document content to be anonymized
 document_content = """Date: October 19, 2021
@@ -78,25 +89,25 @@ time_pattern = Pattern(
     score=1,
 )
 
-# Define the recognizers with the patterns
-polish_id_recognizer = PatternRecognizer(
-    supported_entity="POLISH_ID", patterns=[polish_id_pattern]
+# Define one recognizer that finds both patterns in a single scan
+custom_recognizer = CombinedPatternRecognizer(
+    patterns=[("POLISH_ID", polish_id_pattern), ("TIME", time_pattern)]
 )
-time_recognizer = PatternRecognizer(supported_entity="TIME", patterns=[time_pattern])
 
-# Initialize Faker for custom fake data generation
-fake = Faker()
+# Generate unique fake Polish IDs and times ahead of time, in the background
+surrogate_pools = SurrogatePools()
+surrogate_pools.prefill(["POLISH_ID", "TIME"])
 
 # Custom function to generate fake Polish ID
-def fake_polish_id(_=None):
-    return fake.bothify(text="???######").upper()
+def fake_polish_id(value=None):
+    return surrogate_pools.take("POLISH_ID", value)
 
 # Test the fake Polish ID function
 fake_polish_id()
 
 # Custom function to generate fake time
-def fake_time(_=None):
-    return fake.time(pattern="%I:%M %p")
+def fake_time(value=None):
+    return surrogate_pools.take("TIME", value)
 
 # Test the fake time function
 fake_time()
@@ -113,8 +124,7 @@ anonymizer = PresidioReversibleAnonymizer(
 )
 
 # Add the custom recognizers and operators again
-anonymizer.add_recognizer(polish_id_recognizer)
-anonymizer.add_recognizer(time_recognizer)
+anonymizer.add_recognizer(custom_recognizer)
 anonymizer.add_operators(new_operators)
 
 # Anonymize the document before indexing
@@ -148,10 +158,13 @@ prompt = ChatPromptTemplate.from_template(template)
 
 model = BedrockChat(model_id="anthropic.claude-3-5-sonnet-20240620-v1:0", client=bedrock_client)
 
+# Anonymize one question at a time; the deanonymizer reads the mapping under the same lock
+anonymize = serialized(anonymizer.anonymize)
+
 # Define parallel input processing for the chain
 _inputs = RunnableParallel(
     question=RunnablePassthrough(),
-    anonymized_question=RunnableLambda(anonymizer.anonymize),
+    anonymized_question=RunnableLambda(anonymize),
 )
 
 # Create the anonymizer chain
@@ -171,18 +184,20 @@ anonymizer_chain.invoke(
     "Where did the theft of the wallet occur, at what time, and who was it stolen from?"
 )
 
-# Add deanonymization step to the chain
-chain_with_deanonymization = anonymizer_chain | RunnableLambda(anonymizer.deanonymize)
-
-# Invoke the chain with deanonymization and print the results
-print(
-    chain_with_deanonymization.invoke(
-        "Where did the theft of the wallet occur, at what time, and who was it stolen from?"
-    )
-)
-
-print(
-    chain_with_deanonymization.invoke("What was the content of the wallet in detail?")
-)
-
-print(chain_with_deanonymization.invoke("Whose phone number is it: 999-888-7777?"))
+# Add deanonymization step to the chain, restoring all fake values in one pass.
+# It works on the streamed tokens, so chain_with_deanonymization.stream()
+# yields restored text as it arrives, holding back only a possible fake value
+deanonymizer = Deanonymizer.from_anonymizer(anonymizer, anonymize.lock, version=lambda: anonymize.calls)
+chain_with_deanonymization = anonymizer_chain | RunnableGenerator(deanonymizer.stream, deanonymizer.astream)
+
+# Answer the questions concurrently and print the results in question order
+if QUESTIONS_FILE:
+    questions = load_questions(QUESTIONS_FILE)
+else:
+    questions = [
+        "Where did the theft of the wallet occur, at what time, and who was it stolen from?",
+        "What was the content of the wallet in detail?",
+        "Whose phone number is it: 999-888-7777?",
+    ]
+
+print_answers(answer_questions(chain_with_deanonymization, questions, max_concurrency=QUESTION_CONCURRENCY))
@@ -14,6 +14,7 @@ from operator import itemgetter
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import (
+    RunnableGenerator,
     RunnableLambda,
     RunnableParallel,
     RunnablePassthrough,
@@ -26,16 +27,26 @@ from dotenv import load_dotenv
 from langchain_community.embeddings import BedrockEmbeddings
 from langchain_community.chat_models import BedrockChat
 import docx  # Import for reading .docx files
+from Utility.concurrent_embeddings import ConcurrentEmbeddings
+from Utility.deanonymizer import Deanonymizer
+from Utility.questions import answer_questions, load_questions, print_answers, serialized
+from Utility.windowed import WindowedAnalyzer
 
 # Load environment variables from .env file
 load_dotenv()
 AWS_REGION = os.getenv("AWS_REGIONS")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
+QUESTIONS_FILE = os.getenv("QUESTIONS_FILE")  # Optional file with one question per line
+QUESTION_CONCURRENCY = int(os.getenv("QUESTION_CONCURRENCY", "8"))  # Questions answered at once
 
 # Initialize AWS clients
 s3_client = boto3.client("s3", region_name=AWS_REGION)
 bedrock_client = boto3.client(service_name="bedrock-runtime", region_name=AWS_REGION)
-bedrock_embeddings = BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=bedrock_client)
+
+# Embed chunks concurrently, backing off when Bedrock throttles
+bedrock_embeddings = ConcurrentEmbeddings(
+    BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=bedrock_client)
+)
 
 # Function to read .docx file and return the text content
 def read_docx(file_path):
@@ -100,6 +111,11 @@ anonymizer.add_recognizer(polish_id_recognizer)
 anonymizer.add_recognizer(time_recognizer)
 anonymizer.add_operators(new_operators)
 
+# Analyze long documents in overlapping windows, so spaCy's memory stays flat
+# and its max_length is never hit. PresidioReversibleAnonymizer keeps its
+# analyzer in the private `_analyzer` attribute; this relies on that.
+anonymizer._analyzer = WindowedAnalyzer(anonymizer._analyzer)
+
 # Anonymize the document before indexing
 anonymized_content = anonymizer.anonymize(document_content)
 
@@ -131,10 +147,13 @@ prompt = ChatPromptTemplate.from_template(template)
 
 model = BedrockChat(model_id="anthropic.claude-3-5-sonnet-20240620-v1:0", client=bedrock_client)
 
+# Anonymize one question at a time; the deanonymizer reads the mapping under the same lock
+anonymize = serialized(anonymizer.anonymize)
+
 # Define parallel input processing for the chain
 _inputs = RunnableParallel(
     question=RunnablePassthrough(),
-    anonymized_question=RunnableLambda(anonymizer.anonymize),
+    anonymized_question=RunnableLambda(anonymize),
 )
 
 # Create the anonymizer chain
@@ -154,18 +173,20 @@ anonymizer_chain.invoke(
     "Which Company is a Party A and which company is Party B in this agreement?"
 )
 
-# Add deanonymization step to the chain
-chain_with_deanonymization = anonymizer_chain | RunnableLambda(anonymizer.deanonymize)
-
-# Invoke the chain with deanonymization and print the results
-print(
-    chain_with_deanonymization.invoke(
-        "Which Company is a Party A and which company is Party B in this agreement?"
-    )
-)
-
-print(
-    chain_with_deanonymization.invoke("List all “Specified Entity” means in relation to Party A for the purpose of Section 5(a)(v),")
-)
-
-print(chain_with_deanonymization.invoke("Please summarise Credit Event Upon Merger clause"))
+# Add deanonymization step to the chain, restoring all fake values in one pass.
+# It works on the streamed tokens, so chain_with_deanonymization.stream()
+# yields restored text as it arrives, holding back only a possible fake value
+deanonymizer = Deanonymizer.from_anonymizer(anonymizer, anonymize.lock, version=lambda: anonymize.calls)
+chain_with_deanonymization = anonymizer_chain | RunnableGenerator(deanonymizer.stream, deanonymizer.astream)
+
+# Answer the questions concurrently and print the results in question order
+if QUESTIONS_FILE:
+    questions = load_questions(QUESTIONS_FILE)
+else:
+    questions = [
+        "Which Company is a Party A and which company is Party B in this agreement?",
+        "List all “Specified Entity” means in relation to Party A for the purpose of Section 5(a)(v),",
+        "Please summarise Credit Event Upon Merger clause",
+    ]
+
+print_answers(answer_questions(chain_with_deanonymization, questions, max_concurrency=QUESTION_CONCURRENCY))
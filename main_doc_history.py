@@ -2,14 +2,13 @@ import re
 import json
 import boto3
 import os
+from botocore.exceptions import ClientError
 from docx import Document as DocxDocument
 from langchain_experimental.data_anonymizer import PresidioReversibleAnonymizer
 from presidio_analyzer import Pattern, PatternRecognizer
 from faker import Faker
 from presidio_anonymizer.entities import OperatorConfig
-from langchain_community.vectorstores import FAISS
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.schema import Document
 from operator import itemgetter
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
@@ -19,19 +18,43 @@ from langchain_core.runnables import (
     RunnablePassthrough,
 )
 from dotenv import load_dotenv
+from langchain_community.embeddings import BedrockEmbeddings
+from langchain_community.chat_models import BedrockChat
+from Utility.concurrent_embeddings import ConcurrentEmbeddings
+from Utility.deanonymizer import MAPPING_KEYS, Deanonymizer, chunk_mapping_keys, scoped_mapping
+from Utility.embedding_cache import CachedEmbeddings
+from Utility.faiss_index import VersionedIndexStore, upsert_document
+from Utility.mapping_store import MappingStore
+from Utility.questions import answer_questions, load_questions, print_answers, serialized
+from Utility.windowed import WindowedAnalyzer
 
 # Load environment variables from .env file
 load_dotenv()
 AWS_REGION = os.getenv("AWS_REGION")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
+QUESTIONS_FILE = os.getenv("QUESTIONS_FILE")  # Optional file with one question per line
+QUESTION_CONCURRENCY = int(os.getenv("QUESTION_CONCURRENCY", "8"))  # Questions answered at once
 DOCX_KEY = os.getenv("DOCX_KEY")  # The S3 key for the DOCX file
-EMBEDDINGS_KEY = os.getenv("EMBEDDINGS_KEY", "embeddings.faiss")  # S3 key for embeddings
+EMBEDDINGS_KEY = os.getenv("EMBEDDINGS_KEY", "embeddings.faiss")  # S3 prefix for the versioned FAISS index
 ANONYMIZATION_MAP_KEY = os.getenv("ANONYMIZATION_MAP_KEY", "anonymization_map.json")  # S3 key for the anonymization map
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "/tmp/embedding_cache.sqlite")  # Local embedding cache
+EMBEDDING_CACHE_KEY = os.getenv("EMBEDDING_CACHE_KEY")  # Optional S3 key to mirror the embedding cache to
+ANONYMIZATION_STORE_KEY = os.getenv("ANONYMIZATION_STORE_KEY", "anonymization_store")  # S3 prefix for the trie-backed copy of the map
+ANONYMIZATION_STORE_PATH = os.getenv("ANONYMIZATION_STORE_PATH")  # Local directory for the trie store (default: the temp directory)
 
 # Initialize AWS clients
 s3_client = boto3.client("s3", region_name=AWS_REGION)
 bedrock_client = boto3.client(service_name="bedrock-runtime", region_name=AWS_REGION)
-bedrock_embeddings = BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=bedrock_client)
+
+# Only embed chunks that are not in the local (optionally S3-mirrored) cache yet,
+# and send the misses to Bedrock concurrently, backing off when it throttles
+bedrock_embeddings = CachedEmbeddings(
+    ConcurrentEmbeddings(BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=bedrock_client)),
+    path=EMBEDDING_CACHE_PATH,
+    s3_client=s3_client,
+    bucket=BUCKET_NAME,
+    s3_key=EMBEDDING_CACHE_KEY,
+)
 
 # Function to read .docx file and return the text content
 def read_docx(file_path):
@@ -88,9 +111,19 @@ new_operators = {
     "TIME": OperatorConfig("custom", {"lambda": fake_time}),
 }
 
+# Start from the existing anonymization map, so documents ingested earlier
+# stay deanonymizable and keep the same fake values
+try:
+    s3_client.download_file(BUCKET_NAME, ANONYMIZATION_MAP_KEY, '/tmp/anonymization_map.json')
+    with open('/tmp/anonymization_map.json', 'r') as f:
+        existing_anonymization_map = json.load(f)
+except ClientError:
+    existing_anonymization_map = {}
+
 # Initialize the anonymizer again with a seed for reproducibility
 anonymizer = PresidioReversibleAnonymizer(
     faker_seed=42,
+    deanonymizer_mapping=existing_anonymization_map
 )
 
 # Add the custom recognizers and operators again
@@ -98,6 +131,11 @@ anonymizer.add_recognizer(polish_id_recognizer)
 anonymizer.add_recognizer(time_recognizer)
 anonymizer.add_operators(new_operators)
 
+# Analyze long documents in overlapping windows, so spaCy's memory stays flat
+# and its max_length is never hit. PresidioReversibleAnonymizer keeps its
+# analyzer in the private `_analyzer` attribute; this relies on that.
+anonymizer._analyzer = WindowedAnalyzer(anonymizer._analyzer)
+
 # Anonymize the document before indexing
 anonymized_content = anonymizer.anonymize(document_content)
 
@@ -109,39 +147,45 @@ with open('/tmp/anonymization_map.json', 'w') as f:
     json.dump(anonymization_map, f, indent=4)
 s3_client.upload_file('/tmp/anonymization_map.json', BUCKET_NAME, ANONYMIZATION_MAP_KEY)
 
+# Also upload the map as a read-only trie store that query workers download
+# once per host and memory-map
+MappingStore.build(anonymization_map).upload(s3_client, BUCKET_NAME, ANONYMIZATION_STORE_KEY)
+
 # Split the anonymized content into chunks
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
 chunks = text_splitter.split_text(anonymized_content)
 
-# Convert chunks to Document objects
-documents = [Document(page_content=chunk) for chunk in chunks]
+# Load the latest version of the FAISS index from S3, if there is one
+index_store = VersionedIndexStore(s3_client, BUCKET_NAME, EMBEDDINGS_KEY)
+docsearch, index_version = index_store.load(bedrock_embeddings)
 
-# Index the chunks using Bedrock embeddings
-docsearch = FAISS.from_documents(documents, bedrock_embeddings)
+# Store with each chunk the fake values it contains, so a query only has to
+# look up the originals of the chunks it retrieves
+chunk_metadata = [{MAPPING_KEYS: keys} for keys in chunk_mapping_keys(chunks, anonymization_map)]
 
-# Save the FAISS index to disk and upload to S3
-faiss_index_path = '/tmp/embeddings.faiss'
-docsearch.save_local(faiss_index_path)
-s3_client.upload_file(faiss_index_path, BUCKET_NAME, EMBEDDINGS_KEY)
+# Embed only the new chunks of this document and drop the chunks of its previous version
+docsearch, added, removed = upsert_document(
+    docsearch, bedrock_embeddings, DOCX_KEY, chunks, chunk_metadata=chunk_metadata
+)
+bedrock_embeddings.sync()
+print(f"Indexed {DOCX_KEY}: {added} chunks added, {removed} removed")
+print("Embedding cache:", bedrock_embeddings.stats())
 
-# Later, when you need to query the stored embeddings
+# Save the updated FAISS index to S3 as a new version
+index_version = index_store.save(docsearch, index_version)
 
-# Download the FAISS index and anonymization map from S3
-s3_client.download_file(BUCKET_NAME, EMBEDDINGS_KEY, faiss_index_path)
-s3_client.download_file(BUCKET_NAME, ANONYMIZATION_MAP_KEY, '/tmp/anonymization_map.json')
+# Later, when you need to query the stored embeddings
 
-# Load the FAISS index
-retrieved_docsearch = FAISS.load_local(faiss_index_path, bedrock_embeddings)
+# Download the latest FAISS index from S3
+retrieved_docsearch, _ = index_store.load(bedrock_embeddings)
 
-# Load the anonymization map
-with open('/tmp/anonymization_map.json', 'r') as f:
-    anonymization_map = json.load(f)
-
-# Initialize the anonymizer with the loaded anonymization map
-anonymizer = PresidioReversibleAnonymizer(
-    faker_seed=42,
-    deanonymizer_mapping=anonymization_map
-)
+# Memory-map the trie store instead of loading the whole map into a dict;
+# known values keep their stored fake value, and only values first seen in
+# the questions go into the anonymizer's own mapping, with fake values the
+# store does not already use
+mapping_store = MappingStore.download(s3_client, BUCKET_NAME, ANONYMIZATION_STORE_KEY, ANONYMIZATION_STORE_PATH)
+anonymizer = PresidioReversibleAnonymizer(faker_seed=42)
+anonymizer.add_operators(mapping_store.reuse_known(anonymizer.operators))
 
 # Create the retriever
 retriever = retrieved_docsearch.as_retriever()
@@ -156,36 +200,58 @@ prompt = ChatPromptTemplate.from_template(template)
 
 model = BedrockChat(model_id="anthropic.claude-3-5-sonnet-20240620-v1:0", client=bedrock_client)
 
+# Anonymize one question at a time; the deanonymizer reads the mapping under the same lock
+anonymize = serialized(anonymizer.anonymize)
+
 # Define parallel input processing for the chain
 _inputs = RunnableParallel(
     question=RunnablePassthrough(),
-    anonymized_question=RunnableLambda(anonymizer.anonymize),
+    anonymized_question=RunnableLambda(anonymize),
 )
 
-# Create the anonymizer chain
+# Create the anonymizer chain; the retrieved documents are kept next to the
+# answer, so deanonymization can be limited to the fake values they contain
 anonymizer_chain = (
     _inputs
-    | {
-        "context": itemgetter("anonymized_question") | retriever,
-        "anonymized_question": itemgetter("anonymized_question"),
-    }
-    | prompt
-    | model
-    | StrOutputParser()
+    | RunnablePassthrough.assign(documents=itemgetter("anonymized_question") | retriever)
+    | RunnablePassthrough.assign(
+        answer={
+            "context": itemgetter("documents"),
+            "anonymized_question": itemgetter("anonymized_question"),
+        }
+        | prompt
+        | model
+        | StrOutputParser()
+    )
 )
 
-# Add deanonymization step to the chain
-chain_with_deanonymization = anonymizer_chain | RunnableLambda(anonymizer.deanonymize)
+# Add deanonymization step to the chain, restoring all fake values in one pass
+deanonymizer = Deanonymizer.from_anonymizer(anonymizer, anonymize.lock, version=lambda: anonymize.calls)
+
 
-# Invoke the chain with deanonymization and print the results
-print(
-    chain_with_deanonymization.invoke(
-        "Which Company is a Party A and which company is Party B in this agreement?"
+def deanonymize(result):
+    # Fake values the anonymizer made up for the question itself come first;
+    # the store's own fake values are never reused for them
+    answer = deanonymizer.deanonymize(result["answer"])
+    # Only the originals of the retrieved chunks' fake values are looked up;
+    # chunks indexed without their keys fall back to the whole store
+    mapping = scoped_mapping(
+        result["documents"],
+        lambda entity_type, fake_value: mapping_store.original(fake_value, entity_type),
     )
-)
+    return mapping_store.deanonymize(answer) if mapping is None else Deanonymizer(mapping).deanonymize(answer)
 
-print(
-    chain_with_deanonymization.invoke("List all “Specified Entity” means in relation to Party A for the purpose of Section 5(a)(v),")
-)
 
-print(chain_with_deanonymization.invoke("Please summarise Credit Event Upon Merger clause"))
+chain_with_deanonymization = anonymizer_chain | RunnableLambda(deanonymize)
+
+# Answer the questions concurrently and print the results in question order
+if QUESTIONS_FILE:
+    questions = load_questions(QUESTIONS_FILE)
+else:
+    questions = [
+        "Which Company is a Party A and which company is Party B in this agreement?",
+        "List all “Specified Entity” means in relation to Party A for the purpose of Section 5(a)(v),",
+        "Please summarise Credit Event Upon Merger clause",
+    ]
+
+print_answers(answer_questions(chain_with_deanonymization, questions, max_concurrency=QUESTION_CONCURRENCY))